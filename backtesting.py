@@ -16,9 +16,9 @@
 # 1. Backtesting script (.py)
 # 2. Golden dragon (long term and mid term)
 # 3. Backtest: 1h, 4h, 1D and 1W.
-# todo: 3.1 4h implement separately, because Yahoo Finance doesn't support it
+# 3.1 4h is built from 1h bars, because Yahoo Finance doesn't support it
 # 4. Backtest through Yahoo finance.
-# todo: 5. Backtest more than 1 stock at once
+# 5. Backtest more than 1 stock at once
 # 6. Implement separated backtesting graphs:
 # - Profit/Loss (money)
 # - Profit/loss in %
@@ -26,45 +26,269 @@
 # - Dates.
 # - Buy/sell dots on where it bought and sold on the stock graph.
 # todo: 7. IF there is a period where the value (money) went to 0 the backtest still needs to keep running after that period even if the bot cant buy any more stocks. (In most backtests the backtest will stop per default if the value (money) goes to 0. Because this is a backtest to not buy the underlying but for buying the real company (the stock) the backtest needs to continue even if the value goes to 0. You still own the stocks in that option)
-# todo: 8. It needs to measure total capital that was measured during specific periods. Example: the bot bought 5 stocks and at another time additional 2 stocks. The val (Money) for this period is 60 then the value (money) increased to 80 because of the additional 2 stocks, you now have only 20 in value (money left) to buy stocks for. This measures how exposed/how much capital you used during certain periods its then easier to adjust the first buying value of stock.
-# todo: 9. (Additional, to be added to the strategy) It needs to be able to buy on 1h - 1w graphs.
-# todo: 10. (Additional) STOP LOSS /sell signal (False/true). If the stop loss is set to false, then the bot needs to hold the stock instead of selling it, it then needs to use its "martingale" method to buy at the next buy signal instead. You then average down on your value of the total stocks, But it cant take profit on negative if the average down still is negative even if the bot wants to take profit. If their is a positive amount on the average value of stocks after the second time it bought and the bot got the sell signal as normal its fine. Example you have 10 stocks you bought at 100. You then buy additional 20 stocks at 50. Your average of stocks is = 66.
+# 8. It needs to measure total capital that was measured during specific periods. Example: the bot bought 5 stocks and at another time additional 2 stocks. The val (Money) for this period is 60 then the value (money) increased to 80 because of the additional 2 stocks, you now have only 20 in value (money left) to buy stocks for. This measures how exposed/how much capital you used during certain periods its then easier to adjust the first buying value of stock.
+# 9. (Additional, to be added to the strategy) It needs to be able to buy on 1h - 1w graphs.
+# 10. (Additional) STOP LOSS /sell signal (False/true). If the stop loss is set to false, then the bot needs to hold the stock instead of selling it, it then needs to use its "martingale" method to buy at the next buy signal instead. You then average down on your value of the total stocks, But it cant take profit on negative if the average down still is negative even if the bot wants to take profit. If their is a positive amount on the average value of stocks after the second time it bought and the bot got the sell signal as normal its fine. Example you have 10 stocks you bought at 100. You then buy additional 20 stocks at 50. Your average of stocks is = 66.
 # todo: try fresh install on a new env
 
 # %%
+import numpy as np
+import pandas as pd
 import vectorbt as vbt
+from data_cache import OHLCVCache
+from metrics import returns_metrics
+from portfolio_metrics import portfolio_metrics
+from render import rendering, set_render_mode, show
+from resample import Resampler
+from result_store import ResultStore
 
 
-def backtest_strategy(ticker, start_date, timeframe, fast_ma_period, slow_ma_period):
-    price = vbt.YFData.download(ticker, start=start_date, interval=timeframe).get('Close')
-    fast_ma = vbt.MA.run(price, fast_ma_period, short_name=f'fast_ma_{fast_ma_period}')
-    slow_ma = vbt.MA.run(price, slow_ma_period, short_name=f'slow_ma_{slow_ma_period}')
+FEES = 0.005
+# Timeframes built from one stored base timeframe, so a single 1h download serves all of them. Yahoo Finance
+# doesn't serve 4h at all, and serves 1h bars for the last BASE_HISTORY only: 1d and 1wk are downloaded directly
+# when they start further back.
+RESAMPLED_TIMEFRAMES = {'4h': '1h', '1d': '1h', '1wk': '1h'}
+DIRECT_TIMEFRAMES = ('1d', '1wk')
+BASE_HISTORY = {'1h': pd.Timedelta(days=729)}
+# Rough memory footprint of one price cell through MAs, signals and simulation outputs
+BYTES_PER_CELL = 128
+
+
+# Resampler of the latest base bars per (ticker, start_date, base timeframe), so timeframes built by one call are
+# reused by the next ones as long as the cached base bars don't change
+_resamplers = {}
+
+
+def base_timeframe(timeframe, start_date):
+    # Timeframe to download for the requested one
+    base = RESAMPLED_TIMEFRAMES.get(timeframe)
+    if base is None:
+        return timeframe
+    start = pd.Timestamp(start_date)
+    start = start.tz_localize('UTC') if start.tz is None else start
+    if timeframe in DIRECT_TIMEFRAMES and start < pd.Timestamp.now(tz='UTC') - BASE_HISTORY[base]:
+        return timeframe
+    return base
+
+
+def base_resampler(ticker, start_date, base, cache):
+    data = cache.download(ticker, start=start_date, interval=base).concat()
+    key = (tuple(ticker) if isinstance(ticker, list) else ticker, str(start_date), base)
+    resampler = _resamplers.get(key)
+    if resampler is None or not all(obj.equals(data[name]) for name, obj in resampler.data.items()):
+        resampler = Resampler(data)
+        _resamplers[key] = resampler
+    return resampler
+
+
+def load_data(ticker, start_date, timeframe, cache):
+    # OHLCV features on the requested timeframe, built from the base timeframe where possible
+    base = base_timeframe(timeframe, start_date)
+    if base != timeframe:
+        return base_resampler(ticker, start_date, base, cache).get(timeframe)
+    return cache.download(ticker, start=start_date, interval=timeframe).concat()
+
+
+def run_strategy(price, fast_ma_period, slow_ma_period, resampler=None, signal_timeframe=None, store=None):
+    # Signals can be computed on a higher timeframe and executed on the price timeframe.
+    # With a ResultStore, the simulation is read back if it was run on the same data with the same parameters.
+    signal_price = price
+    if signal_timeframe is not None:
+        signal_price = resampler.get(signal_timeframe)['Close']
+        if isinstance(price, pd.DataFrame):
+            signal_price = signal_price[price.columns]
+    fast_ma = vbt.MA.run(signal_price, fast_ma_period, short_name=f'fast_ma_{fast_ma_period}')
+    slow_ma = vbt.MA.run(signal_price, slow_ma_period, short_name=f'slow_ma_{slow_ma_period}')
     entries = fast_ma.ma_crossed_above(slow_ma)
     exits = fast_ma.ma_crossed_below(slow_ma)
-    pf = vbt.Portfolio.from_signals(price, entries, exits, fees=0.005)
-    plot_strategy(price, fast_ma, slow_ma, pf, timeframe)
-    print(f'\nUseful stats of the backtesting: \n\n{pf.stats()}')
-    print(f'\nInformation about the orders: \n\n{pf.orders.records_readable}')
+    if signal_timeframe is not None:
+        entries = resampler.align(entries, signal_timeframe)
+        exits = resampler.align(exits, signal_timeframe)
+    if store is None:
+        pf = vbt.Portfolio.from_signals(price, entries, exits, fees=FEES)
+    else:
+        tags = strategy_tags(fast_ma_period, slow_ma_period, signal_timeframe)
+        pf = store.run(vbt.Portfolio.from_signals, price, entries, exits, fees=FEES, tags=tags)
+    return fast_ma, slow_ma, pf
+
+
+def strategy_tags(fast_ma_period, slow_ma_period, signal_timeframe=None):
+    # Strategy parameters stored with each run, e.g. store.query(fast_ma_period=50)
+    return dict(fast_ma_period=fast_ma_period, slow_ma_period=slow_ma_period, signal_timeframe=signal_timeframe)
+
+
+def backtest_strategy(ticker, start_date, timeframe, fast_ma_period, slow_ma_period, cache=None,
+                      max_memory=2 ** 30, signal_timeframe=None, store=None, metrics='all', show_orders=True):
+    # ticker can be a single symbol or a list of symbols, the latter are backtested in column chunks.
+    # Pass a ResultStore to skip runs (and chunks of interrupted runs) that were already simulated.
+    # metrics selects the stats to compute, e.g. ['total_return', 'max_dd', 'sharpe_ratio'], see pf.metrics.
+    cache = OHLCVCache() if cache is None else cache
+    data = load_data(ticker, start_date, timeframe, cache)
+    if isinstance(data['Close'], pd.DataFrame):
+        # Align all tickers onto one index
+        keep = data['Close'].notna().any(axis=1).values
+        data = {name: obj[keep] for name, obj in data.items()}
+    price = data['Close']
+    resampler = Resampler(data) if signal_timeframe is not None else None
+    if isinstance(price, pd.Series):
+        fast_ma, slow_ma, pf = run_strategy(price, fast_ma_period, slow_ma_period, resampler, signal_timeframe, store)
+        plot_strategy(price, fast_ma, slow_ma, pf, timeframe)
+        stats = portfolio_metrics(pf).stats(metrics)
+        print(f'\nUseful stats of the backtesting: \n\n{stats}')
+        if show_orders:
+            print(f'\nInformation about the orders: \n\n{pf.orders.records_readable}')
+        return stats
+
+    # Size chunks to the memory budget
+    chunk_len = max(1, int(max_memory // (len(price) * BYTES_PER_CELL)))
+    stats = []
+    for i in range(0, price.shape[1], chunk_len):
+        _, _, pf = run_strategy(
+            price.iloc[:, i:i + chunk_len],
+            fast_ma_period,
+            slow_ma_period,
+            resampler,
+            signal_timeframe,
+            store
+        )
+        if store is None:
+            chunk_stats = portfolio_metrics(pf).stats(metrics)
+        else:
+            chunk_stats = store.stats(store.last_key, metrics)
+        chunk_stats.index = chunk_stats.index.get_level_values('symbol')
+        stats.append(chunk_stats)
+    stats = pd.concat(stats)
+    print(f'\nUseful stats of the backtesting: \n\n{stats}')
+    return stats
 
 
 def plot_strategy(price, fast_ma, slow_ma, pf, timeframe):
+    if not rendering():
+        return  # don't even build the figures
     fig = price.vbt.plot(trace_kwargs=dict(name=f'Close ({timeframe})'))
     fast_ma.ma.vbt.plot(trace_kwargs=dict(name=f'Fast MA ({timeframe})'), fig=fig)
     slow_ma.ma.vbt.plot(trace_kwargs=dict(name=f'Slow MA ({timeframe})'), fig=fig)
     pf.positions.plot(close_trace_kwargs=dict(visible=False), fig=fig)
-    fig.show_png()
-    pf.plot(title='Metrics').show_png()
+    show(fig, f'{price.name}_{timeframe}_strategy')
+    show(pf.plot(title='Metrics'), f'{price.name}_{timeframe}_metrics')
+
+
+def sweep_signals(price, fast_ma_periods, slow_ma_periods):
+    # Entries and exits of every fast < slow combination, computing every distinct window in one batched run
+    windows = np.unique(np.concatenate([np.asarray(fast_ma_periods), np.asarray(slow_ma_periods)]))
+    ma = vbt.MA.run(price, list(windows)).ma.vbt.to_2d_array()
+    # Pair up the columns, keeping only combinations where fast < slow
+    fast_idx, slow_idx = np.meshgrid(
+        np.searchsorted(windows, fast_ma_periods),
+        np.searchsorted(windows, slow_ma_periods),
+        indexing='ij'
+    )
+    valid = windows[fast_idx] < windows[slow_idx]
+    fast_idx, slow_idx = fast_idx[valid], slow_idx[valid]
+    columns = pd.MultiIndex.from_arrays([windows[fast_idx], windows[slow_idx]], names=['fast_ma', 'slow_ma'])
+    fast_ma = pd.DataFrame(ma[:, fast_idx], index=price.index, columns=columns)
+    slow_ma = pd.DataFrame(ma[:, slow_idx], index=price.index, columns=columns)
+    return fast_ma.vbt.crossed_above(slow_ma), fast_ma.vbt.crossed_below(slow_ma)
+
+
+def sweep_portfolio(price, fast_ma_periods, slow_ma_periods):
+    # Simulate all combinations as columns of a single portfolio
+    entries, exits = sweep_signals(price, fast_ma_periods, slow_ma_periods)
+    return vbt.Portfolio.from_signals(price, entries, exits, fees=FEES)
 
 
+def sweep_strategy(ticker, start_date, timeframe, fast_ma_periods, slow_ma_periods, metric='sharpe_ratio',
+                   plot=True, cache=None):
+    cache = OHLCVCache() if cache is None else cache
+    price = load_data(ticker, start_date, timeframe, cache)['Close']
+    pf = sweep_portfolio(price, fast_ma_periods, slow_ma_periods)
+    # All metrics in one fused pass over the returns instead of one pass per metric
+    results = returns_metrics(pf.returns(), pf.returns_acc.ann_factor)
+    results['total_trades'] = pf.trades.count()
+    if plot and rendering():
+        fig = results[metric].vbt.heatmap(
+            x_level='fast_ma',
+            y_level='slow_ma',
+            trace_kwargs=dict(colorbar=dict(title=metric))
+        )
+        show(fig, f'{ticker}_{timeframe}_sweep_{metric}')
+    return results
+
+
+# %%
+if __name__ == '__main__':
+    # Define parameters of the backtesting
+    ticker = 'BTC-USD'  # or a list of tickers, e.g. ['BTC-USD', 'ETH-USD']
+    start_date = '2019-01-01'
+    timeframe = '1d'  # choose any interval from [1m, 2m, 5m, 15m, 30m, 60m, 90m, 1h, 4h, 1d, 5d, 1wk, 1mo, 3mo]
+    fast_ma_period = 50
+    slow_ma_period = 200
+    set_render_mode('inline')  # 'off', 'file', 'inline' or 'queue' (background file writes)
+
+    # Run backtesting, reruns with the same data and parameters are read back from the result store
+    result_store = ResultStore()
+    backtest_strategy(ticker, start_date, timeframe, fast_ma_period, slow_ma_period, store=result_store)
+    print(result_store.query('Portfolio.from_signals')[['key', 'fast_ma_period', 'slow_ma_period', 'size']])
+
+# %%
+if __name__ == '__main__':
+    # Sweep fast/slow periods in one vectorized run
+    sweep_results = sweep_strategy(ticker, start_date, timeframe, range(10, 105, 5), range(50, 310, 10))
+    print(sweep_results.sort_values('sharpe_ratio', ascending=False).head(10))
+
+# %%
+if __name__ == '__main__':
+    # Stop loss on/off and martingale averaging down (todo 10), every combination in one compiled simulation
+    from martingale import martingale_portfolio
+
+    mg_price = load_data(ticker, start_date, timeframe, OHLCVCache())['Close']
+    mg_pf, mg_exposure, _ = martingale_portfolio(mg_price, range(10, 105, 10), range(50, 310, 50),
+                                                 stop_loss=(True, False), multipliers=(1., 2., 3.))
+    mg_total_return = portfolio_metrics(mg_pf)['total_return']
+    print(mg_total_return.unstack(['stop_loss', 'multiplier']).sort_values((False, 2.), ascending=False).head(10))
+
+    # Capital exposure (todo 8) was tracked during the simulation: rank by return per unit of capital deployed
+    mg_exposure['total_return'] = mg_total_return
+    mg_exposure['return_per_exposure'] = mg_exposure['total_return'] / mg_exposure['avg_exposure']
+    print(mg_exposure.sort_values('return_per_exposure', ascending=False).head(10))
+
+# %%
+if __name__ == '__main__':
+    # Walk-forward: optimize on each train window, trade the next test window out of sample
+    from walk_forward import walk_forward
+
+    wf_price = load_data(ticker, start_date, timeframe, OHLCVCache())['Close']
+    wf_folds, wf_returns = walk_forward(wf_price, range(10, 105, 5), range(50, 310, 10), train_len=365, test_len=90)
+    print(wf_folds)
+    print(f'\nOut-of-sample stats: \n\n{wf_returns.vbt.returns.stats()}')
+
 # %%
-# Define parameters of the backtesting
-ticker = 'BTC-USD'  # todo: implement for portfolio
-start_date = '2019-01-01'
-timeframe = '1d'  # choose any interval from [1m, 2m, 5m, 15m, 30m, 60m, 90m, 1h, 1d, 5d, 1wk, 1mo, 3mo]
-fast_ma_period = 50
-slow_ma_period = 200
+if __name__ == '__main__':
+    # Live evaluation: seed the streaming engine from history, then push new bars as they arrive
+    from streaming import StreamingCrossover
 
-# Run backtesting
-backtest_strategy(ticker, start_date, timeframe, fast_ma_period, slow_ma_period)
+    live_price = load_data(ticker, start_date, timeframe, OHLCVCache())['Close']
+    live = StreamingCrossover(fast_ma_period, slow_ma_period).seed(live_price.values[:-1])
+    print(live.push(live_price.values[-1]))
 
 # %%
+if __name__ == '__main__':
+    # Histories larger than memory: store minute bars once in memory-mapped files, then backtest in time chunks
+    from out_of_core import BarStore, backtest_out_of_core
+
+    # Yahoo Finance serves 1m bars for the last 30 days only, append new ones to the store as they arrive
+    bar_store = BarStore()
+    ooc_start = (pd.Timestamp.now(tz='UTC') - pd.Timedelta(days=7)).floor('1D')
+    bar_store.write('1m', load_data(['BTC-USD', 'ETH-USD'], ooc_start, '1m', OHLCVCache()))
+    ooc_result = backtest_out_of_core(bar_store, '1m', fast_ma_period, slow_ma_period, max_memory=2 ** 26)
+    print(ooc_result.summary)
+
+# %%
+if __name__ == '__main__':
+    # Robustness: distribution of CAGR, Sharpe and drawdown over 10k block-bootstrapped paths of the returns
+    from robustness import monte_carlo
+
+    mc_price = load_data(ticker, start_date, timeframe, OHLCVCache())['Close']
+    _, _, mc_pf = run_strategy(mc_price, fast_ma_period, slow_ma_period)
+    mc_result = monte_carlo(mc_pf.returns(), n_paths=10_000, method='block', block_len=20)
+    print(mc_result.intervals.loc[['annualized_return', 'sharpe_ratio', 'max_drawdown']])
@@ -0,0 +1,276 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from importlib.metadata import PackageNotFoundError, version
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+import vectorbt as vbt
+
+from precision import precision_settings, set_precision
+from shared_data import SharedFrame, attach
+from synthetic import save_ohlcv, synthetic_ohlcv
+
+# Offline benchmarks of the main workloads on synthetic data, results go to JSON so runs can be compared
+# before and after an upgrade of the pinned packages:
+#   python benchmarks.py --size small --output before.json
+#   python benchmarks.py --compare before.json after.json
+# The random search tiles the price once per candidate, so memory grows with n_rows * n_assets * num_tests
+SIZES = dict(
+    small=dict(n_rows=750, n_assets=4, num_tests=(100, 1000, 2000)),
+    medium=dict(n_rows=2500, n_assets=10, num_tests=(100, 500, 1000)),
+    large=dict(n_rows=5000, n_assets=20, num_tests=(100, 500, 1000))
+)
+PACKAGES = ('numpy', 'pandas', 'numba', 'vectorbt', 'PyPortfolioOpt', 'pyarrow')
+POOL_TASKS = (1000, 10000)
+
+_shared_price = None
+
+
+def random_weights(num_tests, n_assets, seed=42):
+    # Same draws as the random search in portfolio.py
+    np.random.seed(seed)
+    weights = []
+    for i in range(num_tests):
+        w = np.random.random_sample(n_assets)
+        weights.append(w / np.sum(w))
+    return weights
+
+
+def weights_portfolio(price, weights, rb_mask=None):
+    # Random search of portfolio.py: one symbol group per candidate, allocated once or at every rb_mask day
+    num_tests = len(weights)
+    _price = price.vbt.tile(num_tests, keys=pd.Index(np.arange(num_tests), name='symbol_group'))
+    _price = _price.vbt.stack_index(pd.Index(np.concatenate(weights), name='weights'))
+    size = np.full_like(_price, np.nan)
+    size[0 if rb_mask is None else rb_mask, :] = np.concatenate(weights)
+    return vbt.Portfolio.from_orders(
+        close=_price,
+        size=size,
+        size_type='targetpercent',
+        group_by='symbol_group',
+        cash_sharing=True,
+        call_seq='default' if rb_mask is None else 'auto'
+    )
+
+
+def crossover_workload(ohlcv, data_dir, fast_ma_period=50, slow_ma_period=200):
+    # backtest_strategy over all symbols, served by a file provider from data_dir so no network is touched
+    from backtesting import backtest_strategy
+    from data_cache import FileProvider, OHLCVCache
+    from render import set_render_mode
+
+    set_render_mode('off')
+    symbols = save_ohlcv(ohlcv, data_dir)
+    cache = OHLCVCache(os.path.join(data_dir, 'cache'), provider=FileProvider(data_dir))
+    start_date = ohlcv[symbols[0]].index[0]
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return backtest_strategy(symbols, start_date, '1d', fast_ma_period, slow_ma_period, cache=cache)
+    return run
+
+
+def random_search_workload(price, num_tests):
+    weights = random_weights(num_tests, price.shape[1])
+    return lambda: weights_portfolio(price, weights).sharpe_ratio()
+
+
+def monthly_rebalance_workload(price, num_tests):
+    weights = random_weights(num_tests, price.shape[1])
+    rb_mask = ~price.index.tz_localize(None).to_period('m').duplicated()
+    return lambda: weights_portfolio(price, weights, rb_mask).sharpe_ratio()
+
+
+def weights_search_workload(price, num_tests, dtype='float64'):
+    # Value matrix of the zero-copy random search of weights_search.py in the given precision mode (precision.py)
+    from weights_search import generate_weights, simulate_weights
+
+    weights = generate_weights(num_tests, price.shape[1])
+
+    def run():
+        prev_dtype = precision_settings['dtype']
+        set_precision(dtype)
+        try:
+            return simulate_weights(price, weights)
+        finally:
+            set_precision(prev_dtype)
+    return run
+
+
+def simulate_metrics_workload(price, num_tests):
+    # Metrics of the zero-copy random search reduced chunk by chunk, memory doesn't grow with num_tests
+    from weights_search import generate_weights, simulate_metrics
+
+    weights = generate_weights(num_tests, price.shape[1])
+    return lambda: simulate_metrics(price, weights)
+
+
+def order_func_workload(price, num_tests=2000, every_nth=30, seed=42):
+    # 30-day re-optimization of portfolio.py, searching num_tests candidates at every re-balancing day
+    from portfolio_nb import find_weights_nb, order_func_nb, pre_group_func_nb, pre_segment_func_nb, pre_sim_func_nb
+
+    def run():
+        srb_sharpe = np.full(price.shape[0], np.nan)
+        return vbt.Portfolio.from_order_func(
+            price,
+            order_func_nb,
+            pre_sim_func_nb=pre_sim_func_nb,
+            pre_sim_args=(every_nth,),
+            pre_group_func_nb=pre_group_func_nb,
+            pre_segment_func_nb=pre_segment_func_nb,
+            pre_segment_args=(find_weights_nb, -1, 252, num_tests, seed, srb_sharpe),
+            call_pre_segment=True,
+            cash_sharing=True,
+            group_by=True
+        ).sharpe_ratio()
+    return run
+
+
+def _attach_worker(handle):
+    global _shared_price
+    _shared_price = attach(handle)
+
+
+def _window_mean(price, i, window=20):
+    # A small task reading one window of the price, so the cost of getting the price to the worker dominates
+    start = i % (price.shape[0] - window)
+    return float(price.values[start:start + window].mean())
+
+
+def _pickled_task(price, i):
+    return _window_mean(price, i)
+
+
+def _shared_task(i):
+    return _window_mean(_shared_price, i)
+
+
+def pool_workload(price, n_tasks, shared):
+    # n_tasks process pool tasks over the price, either pickled into every task or published once in shared memory
+    def run():
+        if shared:
+            with SharedFrame(price) as shared_price, \
+                    ProcessPoolExecutor(initializer=_attach_worker, initargs=(shared_price.handle,)) as executor:
+                return list(executor.map(_shared_task, range(n_tasks)))
+        with ProcessPoolExecutor() as executor:
+            return list(executor.map(_pickled_task, repeat(price), range(n_tasks)))
+    return run
+
+
+def workloads(ohlcv, num_tests, data_dir):
+    # (name, params, zero-argument callable) of every benchmarked workload, files they need go to data_dir
+    price = pd.concat({symbol: df['Close'] for symbol, df in ohlcv.items()}, axis=1, names=['symbol'])
+    out = [('crossover', dict(fast_ma_period=50, slow_ma_period=200), crossover_workload(ohlcv, data_dir))]
+    for n in num_tests:
+        out.append(('random_search', dict(num_tests=n), random_search_workload(price, n)))
+    out.append(('monthly_rebalance', dict(num_tests=num_tests[-1]), monthly_rebalance_workload(price, num_tests[-1])))
+    for dtype in ('float64', 'float32'):
+        params = dict(num_tests=10 * num_tests[-1], dtype=dtype)
+        out.append(('weights_search', params, weights_search_workload(price, **params)))
+    for n in (num_tests[-1], 50 * num_tests[-1]):
+        out.append(('simulate_metrics', dict(num_tests=n), simulate_metrics_workload(price, n)))
+    out.append(('order_func_30d', dict(num_tests=2000), order_func_workload(price, 2000)))
+    for n in POOL_TASKS:
+        out.append(('pool_pickle', dict(n_tasks=n), pool_workload(price, n, shared=False)))
+        out.append(('pool_shared', dict(n_tasks=n), pool_workload(price, n, shared=True)))
+    return out
+
+
+def measure(func, repeat=3):
+    # The first call includes JIT compilation and is reported separately. Peak memory is traced over one more
+    # call: it covers Python and NumPy allocations, not those made inside Numba kernels.
+    t0 = time.perf_counter()
+    func()
+    first_call = time.perf_counter() - t0
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return dict(
+        first_call_seconds=first_call,
+        best_seconds=min(times),
+        mean_seconds=float(np.mean(times)),
+        repeat=repeat,
+        peak_traced_bytes=peak
+    )
+
+
+def environment():
+    versions = {}
+    for package in PACKAGES:
+        try:
+            versions[package] = version(package)
+        except PackageNotFoundError:
+            versions[package] = None
+    return dict(
+        timestamp=datetime.now(timezone.utc).isoformat(),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        cpu_count=os.cpu_count(),
+        packages=versions
+    )
+
+
+def run_benchmarks(size='small', repeat=3, only=None, seed=42):
+    config = SIZES[size]
+    ohlcv = synthetic_ohlcv(config['n_rows'], config['n_assets'], seed=seed)
+    results = []
+    with tempfile.TemporaryDirectory() as data_dir:
+        for name, params, func in workloads(ohlcv, config['num_tests'], data_dir):
+            if only is not None and name not in only:
+                continue
+            result = dict(workload=name, size=size, n_rows=config['n_rows'], n_assets=config['n_assets'], **params)
+            result.update(measure(func, repeat))
+            print(f"{name} {params}: {result['best_seconds']:.3f}s, "
+                  f"peak {result['peak_traced_bytes'] / 2 ** 20:.1f} MiB")
+            results.append(result)
+    return dict(environment=environment(), seed=seed, results=results)
+
+
+def compare(old_path, new_path):
+    # Ratio new/old of the best time and peak memory of every workload present in both runs
+    def load(path):
+        with open(path) as f:
+            results = pd.DataFrame(json.load(f)['results'])
+        params = [c for c in results.columns if c in ('workload', 'size', 'num_tests', 'n_tasks', 'dtype')]
+        return results.set_index(params)[['best_seconds', 'peak_traced_bytes']]
+
+    old, new = load(old_path), load(new_path)
+    ratio = (new / old).dropna(how='all').add_suffix('_ratio')
+    return pd.concat([old.add_prefix('old_'), new.add_prefix('new_'), ratio], axis=1, join='inner')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline benchmarks on synthetic data')
+    parser.add_argument('--size', choices=list(SIZES), default='small')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', nargs='+', help='workloads to run, e.g. crossover order_func_30d')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files')
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        print(compare(*args.compare).to_string())
+    else:
+        report = run_benchmarks(args.size, args.repeat, args.only, args.seed)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Results written to {args.output}')
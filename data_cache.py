@@ -0,0 +1,119 @@
+import os
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+import pandas as pd
+import vectorbt as vbt
+
+
+def _to_timestamp(value, tz):
+    # Bring a user-supplied bound into the timezone of the stored index
+    ts = pd.Timestamp(value)
+    if tz is None:
+        return ts.tz_localize(None) if ts.tzinfo is not None else ts
+    if ts.tzinfo is None:
+        return ts.tz_localize(tz)
+    return ts.tz_convert(tz)
+
+
+def _slice(df, start=None, end=None):
+    # Select bars in [start, end), same as Yahoo Finance does
+    if start is not None:
+        df = df[df.index >= _to_timestamp(start, df.index.tz)]
+    if end is not None:
+        df = df[df.index < _to_timestamp(end, df.index.tz)]
+    return df
+
+
+def _file_stem(symbol, interval):
+    return f"{symbol.replace('/', '_')}_{interval}"
+
+
+class DataProvider(ABC):
+    # Source of OHLCV bars for one symbol, returns a DataFrame indexed by time
+    @abstractmethod
+    def fetch(self, symbol, interval, start=None, end=None):
+        pass
+
+
+class YFProvider(DataProvider):
+    def fetch(self, symbol, interval, start=None, end=None):
+        kwargs = dict(interval=interval)
+        if start is not None:
+            kwargs['start'] = start
+        if end is not None:
+            kwargs['end'] = end
+        return vbt.YFData.download(symbol, **kwargs).get()
+
+
+class FileProvider(DataProvider):
+    # Serves bars from local files named <symbol>_<interval>.parquet/.csv, no network involved
+    def __init__(self, data_dir):
+        self.data_dir = Path(data_dir)
+
+    def fetch(self, symbol, interval, start=None, end=None):
+        name = _file_stem(symbol, interval)
+        path = self.data_dir / f'{name}.parquet'
+        if path.exists():
+            df = pd.read_parquet(path)
+        else:
+            df = pd.read_csv(self.data_dir / f'{name}.csv', index_col=0, parse_dates=True)
+        return _slice(df, start, end)
+
+
+class OHLCVCache:
+    # Local Parquet store keyed by symbol and interval, only bars after the last stored one are fetched
+    def __init__(self, cache_dir='.ohlcv_cache', provider=None, offline=False):
+        self.cache_dir = Path(cache_dir)
+        self.provider = YFProvider() if provider is None else provider
+        self.offline = offline
+
+    def path(self, symbol, interval):
+        return self.cache_dir / f'{_file_stem(symbol, interval)}.parquet'
+
+    def load(self, symbol, interval):
+        path = self.path(symbol, interval)
+        if not path.exists():
+            return None
+        return pd.read_parquet(path)
+
+    def save(self, symbol, interval, df):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self.path(symbol, interval)
+        tmp_path = path.with_suffix('.tmp')
+        df.to_parquet(tmp_path)
+        os.replace(tmp_path, path)  # never leave a half-written file behind
+
+    def fetch(self, symbol, interval='1d', start=None, end=None):
+        cached = self.load(symbol, interval)
+        if self.offline:
+            if cached is None:
+                raise ValueError(f'No cached data for {symbol} ({interval}) in offline mode')
+            return _slice(cached, start, end)
+
+        if cached is None or cached.empty:
+            df = self.provider.fetch(symbol, interval, start=start, end=end)
+        else:
+            parts = []
+            first, last = cached.index[0], cached.index[-1]
+            if start is not None and _to_timestamp(start, cached.index.tz) < first:
+                # Extend history backwards
+                head = self.provider.fetch(symbol, interval, start=start, end=first)
+                parts.append(head[head.index < first])
+            parts.append(cached)
+            if end is None or _to_timestamp(end, cached.index.tz) > last:
+                # Re-fetch the last stored bar as well, it may have been incomplete
+                parts.append(self.provider.fetch(symbol, interval, start=last, end=end))
+            df = pd.concat(parts)
+            df = df[~df.index.duplicated(keep='last')].sort_index()
+
+        if not df.equals(cached):
+            self.save(symbol, interval, df)
+        return _slice(df, start, end)
+
+    def download(self, symbols, start=None, end=None, interval='1d'):
+        # Drop-in replacement for vbt.YFData.download
+        if isinstance(symbols, str):
+            symbols = [symbols]
+        data = {symbol: self.fetch(symbol, interval, start=start, end=end) for symbol in symbols}
+        return vbt.YFData.from_data(data, download_kwargs=dict(start=start, end=end, interval=interval))
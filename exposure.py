@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+from numba import njit
+
+from precision import value_dtype
+
+# Capital exposure (todo #8) accumulated inside from_order_func simulations, one row per group
+# (per column without grouping). All values are taken at the close of each bar.
+EXPOSURE_FIELDS = (
+    'max_deployed',  # peak capital held in positions
+    'peak_exposure',  # peak share of the portfolio value held in positions
+    'avg_exposure',  # time-weighted (per bar) average of that share
+    'min_cash',  # least cash left to buy with
+    'cash_left'  # cash at the last bar
+)
+
+
+def exposure_arrays(n_rows, n_groups, per_bar=False):
+    # Buffers to pass into the simulation: the summary, and the capital deployed at every bar if per_bar.
+    # The latter is in the dtype of the precision mode (see precision.py), the summary is always float64.
+    exposure_out = np.zeros((n_groups, len(EXPOSURE_FIELDS)), dtype=np.float_)
+    exposure_out[:, 3] = np.inf
+    exposure_out[:, 4] = np.nan
+    deployed_out = np.full((n_rows, n_groups) if per_bar else (0, n_groups), np.nan, dtype=value_dtype())
+    return exposure_out, deployed_out
+
+
+@njit(cache=True)
+def update_exposure_nb(c, exposure_out, deployed_out):
+    # Call from post_segment_func_nb with call_post_segment=True, so that every bar is counted
+    deployed = 0.
+    for col in range(c.from_col, c.to_col):
+        if c.last_position[col] != 0:
+            deployed += abs(c.last_position[col]) * c.last_val_price[col]
+    if c.cash_sharing:
+        cash = c.last_cash[c.group]
+        value = c.last_value[c.group]
+    else:
+        cash = 0.
+        value = 0.
+        for col in range(c.from_col, c.to_col):
+            cash += c.last_cash[col]
+            value += c.last_value[col]
+    exposure = deployed / value if value > 0 else 0.
+
+    out = exposure_out[c.group]
+    out[0] = max(out[0], deployed)
+    out[1] = max(out[1], exposure)
+    out[2] += (exposure - out[2]) / (c.i + 1)
+    out[3] = min(out[3], cash)
+    out[4] = cash
+    if deployed_out.shape[0] > 0:
+        deployed_out[c.i, c.group] = deployed
+
+
+def exposure_summary(wrapper, exposure_out):
+    # Summary as a DataFrame with one row per group/column of the portfolio (pf.wrapper)
+    return pd.DataFrame(exposure_out, index=wrapper.get_columns(), columns=EXPOSURE_FIELDS)
+
+
+def deployed_series(wrapper, deployed_out):
+    return pd.DataFrame(deployed_out, index=wrapper.index, columns=wrapper.get_columns())
@@ -38,7 +38,7 @@
 
 # %%
 # Install yfinance on the system
-# !pip install yfinance seaborn
+# !pip install yfinance
 
 # %% [markdown]
 # After running this cell, you will receive information related to the installation as an output. Everything should already be installed on the system.
@@ -52,10 +52,9 @@ import yfinance as yf
 # Pandas and numpy are used for data manipulation
 import pandas as pd
 import numpy as np
-# Matplotlib and seaborn are used for plotting graph
+# Matplotlib is used for plotting graph
 import matplotlib.pyplot as plt
 # %matplotlib inline
-import seaborn as sns
 
 # %% [markdown]
 # ## Data preparation
@@ -157,24 +156,17 @@ plt.show()
 # However, in practice, it’s better to use a combination of metrics for evaluating the effectiveness of your strategy.
 
 # %%
-# Total number of trading days
-days = len(cumulative_returns)
-# Calculate compounded annual growth rate
-annualized_returns = (cumulative_returns.iloc[-1]**(365/days)-1)*100
-# Calculate annualized volatility
-annualized_volatility = np.std(data.strategy_returns)*(365**0.5)*100
+from metrics import returns_metrics
+
 # Assume an average annual risk-free rate is 1%
 risk_free_rate = 0.01/365
-# Calculate Sharpe Ratio
-sharpe_ratio = np.sqrt(365)*(np.mean(data.strategy_returns) -
-(risk_free_rate))/np.std(data.strategy_returns)
-# Calculate the running maximum
-running_max = np.maximum.accumulate(cumulative_returns.dropna())
-# Ensure the value never drops below 1
-running_max[running_max < 1] = 1
-# Calculate the percentage drawdown
-drawdown = (cumulative_returns)/running_max - 1
-max_dd = drawdown.min()*100
+# Compounded annual growth rate, annualized volatility, Sharpe ratio and drawdown from the running maximum, all
+# in a single pass over the strategy returns. Volatility is the sample standard deviation, like in vectorbt.
+strategy_metrics = returns_metrics(data['strategy_returns'], 365, risk_free_rate)
+annualized_returns = strategy_metrics['annualized_return']*100
+annualized_volatility = strategy_metrics['annualized_volatility']*100
+sharpe_ratio = strategy_metrics['sharpe_ratio']
+max_dd = strategy_metrics['max_drawdown']*100
 print('The annualized returns of strategy is %.2f' % annualized_returns + '%')
 print('The annualized volatility of strategy is %.2f' % annualized_volatility + '%')
 print('The sharpe ratio is %.2f' % sharpe_ratio)
@@ -209,3 +201,29 @@ print('The percentage drawdown is %.2f' % max_dd + '%')
 # ~~~
 #
 # Also, this is a simple backtest against the strategy which doesn’t include possible fees, commissions or other factors, but you have run through the simplified process of backtesting, **congratulations on this**!
+
+# %% [markdown]
+# ## Evaluating many window pairs at once
+# The 50/200 pair is only one choice. Instead of adding a column per moving average, position and return, `ma_signals.py` computes the moving averages of all windows from a single cumulative sum and builds position and strategy-return matrices with one column per short/long pair, leaving `data` untouched. Hundreds of pairs cost about as much as one.
+
+# %%
+from ma_signals import crossover_grid
+
+# Moving averages, positions and strategy returns of every pair with short window < long window
+grid_mavg, grid_positions, grid_returns = crossover_grid(data['Close'], range(10, 105, 5), range(50, 310, 10))
+# Same metrics as above (sample standard deviation), one row per pair, all pairs in one parallel pass
+grid_metrics = returns_metrics(grid_returns, 365, risk_free_rate)
+print('%d window pairs' % len(grid_metrics))
+grid_metrics.sort_values('sharpe_ratio', ascending=False).head(10)
+
+# %% [markdown]
+# ## How robust are these numbers?
+# The annualized return, Sharpe ratio and drawdown above come from a single historical path. `robustness.py` resamples the strategy returns into thousands of alternative paths, in blocks of consecutive days to keep trends and volatility clusters, and reports the range the metrics fall in. A wide interval, or one that includes a negative Sharpe ratio, means the result may owe a lot to luck.
+
+# %%
+from robustness import monte_carlo
+
+mc_result = monte_carlo(data['strategy_returns'], n_paths=10_000, method='block', block_len=20, ann_factor=365,
+                        risk_free=risk_free_rate)
+# observed is the historical value, lower/upper bound the 95% interval over the paths
+mc_result.intervals.loc[['annualized_return', 'sharpe_ratio', 'max_drawdown']]
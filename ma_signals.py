@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+
+# Columnar version of the hello_algo_trading.py pipeline for many window pairs at once: the moving averages of
+# all windows come from one cumulative sum, and positions and strategy returns are matrices with one column
+# per (short_window, long_window) pair. The input series is never modified.
+
+
+def moving_averages(close, windows):
+    # Same as close.rolling(window).mean() for every window (to ~1e-11 relative, the cumulative sum grows with
+    # the series): NaN for the first window - 1 rows and for windows containing a NaN
+    values = np.asarray(close, dtype=np.float_)
+    is_nan = np.isnan(values)
+    csum = np.concatenate(([0.], np.cumsum(np.where(is_nan, 0., values))))
+    nan_count = np.concatenate(([0], np.cumsum(is_nan)))
+    out = np.full((len(values), len(windows)), np.nan)
+    for k, window in enumerate(windows):
+        if window > len(values):
+            continue
+        mean = (csum[window:] - csum[:-window]) / window
+        mean[nan_count[window:] - nan_count[:-window] > 0] = np.nan
+        out[window - 1:, k] = mean
+    return pd.DataFrame(out, index=close.index, columns=pd.Index(windows, name='window'))
+
+
+def window_pairs(short_windows, long_windows):
+    return [(short, long) for short in short_windows for long in long_windows if short < long]
+
+
+def crossover_positions(ma, pairs):
+    # 1 while the short MA is above the long MA, -1 while it's below, 0 otherwise (equal or not available yet)
+    short = ma[[short for short, _ in pairs]].values
+    long = ma[[long for _, long in pairs]].values
+    positions = (short > long).astype(np.int8) - (short < long)
+    columns = pd.MultiIndex.from_tuples(pairs, names=['short_window', 'long_window'])
+    return pd.DataFrame(positions, index=ma.index, columns=columns)
+
+
+def strategy_returns(close, positions):
+    # Daily returns times the position held since the previous day, per column of positions
+    returns = np.asarray(close.pct_change(), dtype=np.float_)
+    out = np.full(positions.shape, np.nan)
+    out[1:] = returns[1:, None] * positions.values[:-1]
+    return pd.DataFrame(out, index=positions.index, columns=positions.columns)
+
+
+def crossover_grid(close, short_windows, long_windows):
+    # Moving averages of every window, positions and strategy returns of every short < long pair
+    windows = sorted(set(short_windows) | set(long_windows))
+    ma = moving_averages(close, windows)
+    positions = crossover_positions(ma, window_pairs(short_windows, long_windows))
+    return ma, positions, strategy_returns(close, positions)
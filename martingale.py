@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+import vectorbt as vbt
+from numba import njit
+from vectorbt.portfolio.enums import Direction, OrderSide, OrderStatus, SizeType
+from vectorbt.portfolio.nb import order_nb, order_nothing_nb
+
+from backtesting import FEES, sweep_signals
+from exposure import deployed_series, exposure_arrays, exposure_summary, update_exposure_nb
+from precision import mask_bit_nb, pack_mask, value_dtype
+
+# MA crossover with an optional stop loss (todo #10). With the stop loss off, a sell signal is ignored while the
+# position is under water, and the next buy signal averages down by buying multiplier times the previous buy.
+# Entry and exit signals are passed packed 8 columns per byte (precision.pack_mask).
+
+
+@njit(cache=True)
+def pre_sim_func_nb(c):
+    # Cost basis (fees included) and size of the last buy of each column
+    avg_price = np.full(c.target_shape[1], np.nan, dtype=np.float_)
+    last_size = np.zeros(c.target_shape[1], dtype=np.float_)
+    return avg_price, last_size
+
+
+@njit(cache=True)
+def order_func_nb(c, avg_price, last_size, entries, exits, stop_loss, multiplier, base_size, fees):
+    close = np.float_(c.close[c.i, c.col])
+    if mask_bit_nb(entries, c.i, c.col):
+        if c.position_now == 0:
+            # Open with a fraction of the cash
+            return order_nb(base_size, close, size_type=SizeType.Percent, fees=fees, direction=Direction.LongOnly)
+        if close < avg_price[c.col]:
+            # Average down
+            return order_nb(last_size[c.col] * multiplier[c.col], close, fees=fees, direction=Direction.LongOnly)
+    elif mask_bit_nb(exits, c.i, c.col) and c.position_now > 0:
+        # Without a stop loss, only sell if it doesn't realize a loss after fees
+        if stop_loss[c.col] or close * (1 - fees) >= avg_price[c.col]:
+            return order_nb(-np.inf, close, fees=fees, direction=Direction.LongOnly)
+    return order_nothing_nb()
+
+
+@njit(cache=True)
+def post_order_func_nb(c, avg_price, last_size):
+    # Update the cost basis from the filled order
+    if c.order_result.status != OrderStatus.Filled:
+        return
+    size = c.order_result.size
+    if c.order_result.side == OrderSide.Buy:
+        prev_position = c.position_now - size
+        prev_cost = 0. if prev_position == 0 else prev_position * avg_price[c.col]
+        avg_price[c.col] = (prev_cost + size * c.order_result.price + c.order_result.fees) / c.position_now
+        last_size[c.col] = size
+    elif c.position_now == 0:
+        avg_price[c.col] = np.nan
+        last_size[c.col] = 0.
+
+
+@njit(cache=True)
+def post_segment_func_nb(c, avg_price, last_size, exposure_out, deployed_out):
+    update_exposure_nb(c, exposure_out, deployed_out)
+
+
+def martingale_portfolio(price, fast_ma_periods, slow_ma_periods, stop_loss=(True, False), multipliers=(1., 2.),
+                         base_size=0.1, fees=FEES, per_bar_exposure=False):
+    # Every combination of fast/slow periods, stop loss on/off and martingale multiplier as columns of one
+    # compiled simulation. base_size is the fraction of cash used to open a position. The close matrix is in the
+    # dtype of the precision mode (see precision.py), cash and positions are simulated in float64 either way.
+    # Returns the portfolio, its exposure summary per column and, if per_bar_exposure, the capital deployed per bar.
+    entries, exits = sweep_signals(price, fast_ma_periods, slow_ma_periods)
+    n_pairs = entries.shape[1]
+    columns = pd.MultiIndex.from_tuples(
+        [(*pair, sl, m) for pair in entries.columns for sl in stop_loss for m in multipliers],
+        names=[*entries.columns.names, 'stop_loss', 'multiplier']
+    )
+    n_repeat = len(stop_loss) * len(multipliers)
+    exposure_out, deployed_out = exposure_arrays(len(price), len(columns), per_bar_exposure)
+    close = pd.DataFrame(
+        np.repeat(price.values.astype(value_dtype())[:, None], len(columns), axis=1),
+        index=price.index,
+        columns=columns
+    )
+    pf = vbt.Portfolio.from_order_func(
+        close,
+        order_func_nb,
+        pack_mask(np.repeat(entries.values, n_repeat, axis=1)),
+        pack_mask(np.repeat(exits.values, n_repeat, axis=1)),
+        np.tile(np.repeat(np.asarray(stop_loss, dtype=np.bool_), len(multipliers)), n_pairs),
+        np.tile(np.asarray(multipliers, dtype=np.float_), n_pairs * len(stop_loss)),
+        base_size,
+        fees,
+        pre_sim_func_nb=pre_sim_func_nb,
+        post_order_func_nb=post_order_func_nb,
+        post_segment_func_nb=post_segment_func_nb,
+        post_segment_args=(exposure_out, deployed_out),
+        call_post_segment=True
+    )
+    deployed = deployed_series(pf.wrapper, deployed_out) if per_bar_exposure else None
+    return pf, exposure_summary(pf.wrapper, exposure_out), deployed
@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+from numba import njit, prange
+
+METRICS = (
+    'total_return',
+    'annualized_return',
+    'annualized_volatility',
+    'sharpe_ratio',
+    'sortino_ratio',
+    'max_drawdown',
+    'max_drawdown_duration'
+)
+
+
+@njit(parallel=True, cache=True)
+def returns_metrics_nb(returns, ann_factor, risk_free):
+    # All metrics of each column in a single pass, definitions follow vectorbt's returns accessor
+    n_rows, n_cols = returns.shape
+    out = np.full((n_cols, len(METRICS)), np.nan)
+
+    for col in prange(n_cols):
+        value = 1.
+        peak = -np.inf
+        max_dd = 0.
+        dd_len = 0
+        max_dd_len = 0
+        count = 0
+        mean = 0.
+        m2 = 0.
+        down_sq = 0.
+        for i in range(n_rows):
+            r = returns[i, col]
+            if not np.isnan(r):
+                value *= 1 + r
+                # Welford's update of mean and variance of excess returns
+                adj = r - risk_free
+                count += 1
+                delta = adj - mean
+                mean += delta / count
+                m2 += delta * (adj - mean)
+                if adj < 0:
+                    down_sq += adj * adj
+            # Drawdown from the running peak and time spent under it
+            if value >= peak:
+                peak = value
+                dd_len = 0
+            else:
+                max_dd = min(max_dd, value / peak - 1)
+                dd_len += 1
+                max_dd_len = max(max_dd_len, dd_len)
+
+        out[col, 0] = value - 1
+        out[col, 1] = value ** (ann_factor / n_rows) - 1
+        out[col, 5] = max_dd
+        out[col, 6] = max_dd_len
+        # Ratios need at least 2 returns (e.g. not a column that never trades), 0 / 0 is NaN, x / 0 is +-inf
+        if count >= 2:
+            std = np.sqrt(m2 / (count - 1))
+            downside = np.sqrt(down_sq / count) * np.sqrt(ann_factor)
+            out[col, 2] = std * np.sqrt(ann_factor)
+            if std == 0:
+                out[col, 3] = np.nan if mean == 0 else np.sign(mean) * np.inf
+            else:
+                out[col, 3] = mean / std * np.sqrt(ann_factor)
+            if downside == 0:
+                out[col, 4] = np.nan if mean == 0 else np.sign(mean) * np.inf
+            else:
+                out[col, 4] = mean * ann_factor / downside
+
+    return out
+
+
+def returns_metrics(returns, ann_factor, risk_free=0.):
+    # Metrics of a returns Series (-> Series) or of every column of a DataFrame (-> DataFrame),
+    # max_drawdown_duration is in bars
+    arr = np.asarray(returns, dtype=np.float_)
+    out = returns_metrics_nb(arr.reshape((arr.shape[0], -1)), ann_factor, risk_free)
+    if isinstance(returns, pd.Series):
+        return pd.Series(out[0], index=METRICS, name=returns.name)
+    if isinstance(returns, pd.DataFrame):
+        return pd.DataFrame(out, index=returns.columns, columns=METRICS)
+    return out
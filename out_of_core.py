@@ -0,0 +1,290 @@
+import json
+import os
+import shutil
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+import vectorbt as vbt
+from numba import njit
+from vectorbt.portfolio.enums import Direction, OrderSide, OrderStatus, ProcessOrderState, order_dt
+from vectorbt.portfolio.nb import execute_order_nb, order_nb
+from vectorbt.utils.math_ import add_nb
+
+from backtesting import FEES
+
+# Out-of-core MA crossover for histories that don't fit in memory, e.g. years of minute bars of a universe.
+# Bars live in memory-mapped files (BarStore), the backtest streams over them in time chunks and carries
+# the MA, crossover, position and cash state across chunk boundaries. Orders and values are identical to
+# vbt.Portfolio.from_signals on the whole history (run_strategy in backtesting.py): every step uses
+# vectorbt's own arithmetic. Memory depends on the chunk length and the number of symbols only.
+FIELDS = ('Open', 'High', 'Low', 'Close', 'Volume')
+# Memory of one cell of a chunk: close, both MAs, signals and value
+BYTES_PER_CELL = 40
+
+OutOfCoreResult = namedtuple('OutOfCoreResult', ['order_records', 'value', 'summary'])
+
+
+class BarStore:
+    # Aligned bars of many symbols per interval, one raw float64 file of shape (n_rows, n_symbols) per field,
+    # row-major so that a time chunk is one contiguous read. Rows are appended as new bars arrive:
+    #   <root>/<interval>/meta.json, index.i8 (UTC nanoseconds), Open.f8, ..., Volume.f8
+    def __init__(self, root='.bar_store'):
+        self.root = root
+
+    def _dir(self, interval):
+        return os.path.join(self.root, interval)
+
+    def meta(self, interval):
+        path = os.path.join(self._dir(interval), 'meta.json')
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def write(self, interval, data):
+        shutil.rmtree(self._dir(interval), ignore_errors=True)
+        return self.append(interval, data)
+
+    def append(self, interval, data):
+        # data maps fields to DataFrames indexed by time with one column per symbol, as returned by
+        # OHLCVCache.download(...).concat(). Rows must be newer than the stored ones.
+        close = data['Close']
+        index = pd.DatetimeIndex(close.index)
+        index = index.tz_localize('UTC') if index.tz is None else index.tz_convert('UTC')
+        meta = self.meta(interval)
+        if meta is None:
+            meta = dict(symbols=[str(s) for s in close.columns], fields=[f for f in FIELDS if f in data], n_rows=0)
+            os.makedirs(self._dir(interval))
+        else:
+            if [str(s) for s in close.columns] != meta['symbols']:
+                raise ValueError('Appended bars must have the same symbols as the stored ones')
+            if meta['n_rows'] > 0 and index[0].value <= self.index(interval)[-1]:
+                raise ValueError('Appended bars must be newer than the stored ones')
+        with open(os.path.join(self._dir(interval), 'index.i8'), 'ab') as f:
+            f.write(np.ascontiguousarray(index.asi8, dtype=np.int64).tobytes())
+        for field in meta['fields']:
+            with open(os.path.join(self._dir(interval), f'{field}.f8'), 'ab') as f:
+                f.write(np.ascontiguousarray(data[field].values, dtype=np.float_).tobytes())
+        meta['n_rows'] += len(index)
+        with open(os.path.join(self._dir(interval), 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        return meta['n_rows']
+
+    def symbols(self, interval):
+        return self.meta(interval)['symbols']
+
+    def index(self, interval):
+        # UTC nanoseconds of every stored bar, pd.to_datetime(..., utc=True) for timestamps
+        meta = self.meta(interval)
+        if meta['n_rows'] == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.memmap(os.path.join(self._dir(interval), 'index.i8'), dtype=np.int64, mode='r')
+
+    def bars(self, interval, field='Close'):
+        # Read-only memory map of shape (n_rows, n_symbols), only the pages that are read get loaded
+        meta = self.meta(interval)
+        shape = (meta['n_rows'], len(meta['symbols']))
+        if meta['n_rows'] == 0:
+            return np.empty(shape)
+        return np.memmap(os.path.join(self._dir(interval), f'{field}.f8'), dtype=np.float_, mode='r', shape=shape)
+
+
+@njit(cache=True)
+def rolling_mean_chunk_nb(close, window, start, cumsum, nancnt, cumsum_buf, nancnt_buf, out):
+    # vectorbt's rolling_mean_1d_nb with minp=window for rows start.. of the history. The running sums (n_cols)
+    # and ring buffers of their last window values (window, n_cols) carry the state to the next chunk.
+    for k in range(close.shape[0]):
+        i = start + k
+        j = i % window
+        for col in range(close.shape[1]):
+            if np.isnan(close[k, col]):
+                nancnt[col] = nancnt[col] + 1
+            else:
+                cumsum[col] = cumsum[col] + close[k, col]
+            if i < window:
+                window_len = i + 1 - nancnt[col]
+                window_cumsum = cumsum[col]
+            else:
+                window_len = window - (nancnt[col] - nancnt_buf[j, col])
+                window_cumsum = cumsum[col] - cumsum_buf[j, col]
+            cumsum_buf[j, col] = cumsum[col]
+            nancnt_buf[j, col] = nancnt[col]
+            if window_len < window:
+                out[k, col] = np.nan
+            else:
+                out[k, col] = window_cumsum / window_len
+
+
+@njit(cache=True)
+def crossed_above_chunk_nb(arr1, arr2, was_below, crossed_ago, out):
+    # vectorbt's crossed_above_1d_nb with wait=0, was_below and crossed_ago (n_cols) carry the state
+    for k in range(arr1.shape[0]):
+        for col in range(arr1.shape[1]):
+            if np.isnan(arr1[k, col]) or np.isnan(arr2[k, col]):
+                crossed_ago[col] = -1
+                was_below[col] = False
+                out[k, col] = False
+            elif arr1[k, col] > arr2[k, col]:
+                if was_below[col]:
+                    crossed_ago[col] += 1
+                    out[k, col] = crossed_ago[col] == 0
+                else:
+                    out[k, col] = False
+            elif arr1[k, col] == arr2[k, col]:
+                crossed_ago[col] = -1
+                out[k, col] = False
+            else:
+                crossed_ago[col] = -1
+                was_below[col] = True
+                out[k, col] = False
+
+
+@njit(cache=True)
+def simulate_chunk_nb(close, entries, exits, start, sim_state, value_state, order_records, summary, value_out,
+                      fees, fixed_fees, slippage, min_size, max_size, size_granularity, lock_cash, allow_partial):
+    # from_signals with a long-only entry of all cash and an exit of the whole position, followed by vectorbt's
+    # reconstruction of cash, assets and value from the filled orders.
+    # sim_state (cash, position, debt, free_cash) and value_state (cash, assets, last valid close) are (3|4, n_cols),
+    # summary (end_value, peak_value, max_drawdown, total_orders, total_fees_paid) is (5, n_cols).
+    oidx = 0
+    for col in range(close.shape[1]):
+        for k in range(close.shape[0]):
+            price = close[k, col]
+            position = sim_state[1, col]
+            size = np.nan
+            if entries[k, col] and position == 0:
+                size = np.inf
+            elif exits[k, col] and position > 0:
+                size = -position
+            flow = 0.
+            asset_flow = 0.
+            if not np.isnan(size):
+                state = ProcessOrderState(
+                    cash=sim_state[0, col],
+                    position=position,
+                    debt=sim_state[2, col],
+                    free_cash=sim_state[3, col],
+                    val_price=price,
+                    value=sim_state[0, col] + position * price,
+                    oidx=0,
+                    lidx=0
+                )
+                order = order_nb(
+                    size,
+                    price,
+                    direction=Direction.LongOnly,
+                    fees=fees,
+                    fixed_fees=fixed_fees,
+                    slippage=slippage,
+                    min_size=min_size,
+                    max_size=max_size,
+                    size_granularity=size_granularity,
+                    lock_cash=lock_cash,
+                    allow_partial=allow_partial
+                )
+                exec_state, order_result = execute_order_nb(state, order)
+                sim_state[0, col] = exec_state.cash
+                sim_state[1, col] = exec_state.position
+                sim_state[2, col] = exec_state.debt
+                sim_state[3, col] = exec_state.free_cash
+                if order_result.status == OrderStatus.Filled:
+                    record = order_records[oidx]
+                    record['id'] = oidx
+                    record['col'] = col
+                    record['idx'] = start + k
+                    record['size'] = order_result.size
+                    record['price'] = order_result.price
+                    record['fees'] = order_result.fees
+                    record['side'] = order_result.side
+                    oidx += 1
+                    order_size = order_result.size if order_result.side == OrderSide.Buy else -order_result.size
+                    flow = add_nb(0., -order_size * order_result.price - order_result.fees)
+                    asset_flow = add_nb(0., order_size)
+                    summary[3, col] += 1
+                    summary[4, col] += order_result.fees
+
+            # Cash, assets and value as the portfolio computes them from its order records
+            value_state[0, col] = add_nb(value_state[0, col], flow)
+            value_state[1, col] = add_nb(value_state[1, col], asset_flow)
+            if not np.isnan(price):
+                value_state[2, col] = price
+            if value_state[1, col] == 0:
+                value = value_state[0, col] + 0.
+            else:
+                value = value_state[0, col] + value_state[2, col] * value_state[1, col]
+            value_out[k, col] = value
+            summary[0, col] = value
+            summary[1, col] = max(summary[1, col], value)
+            summary[2, col] = min(summary[2, col], (value - summary[1, col]) / summary[1, col])
+    return oidx
+
+
+def backtest_out_of_core(store, interval, fast_ma_period, slow_ma_period, fees=FEES, max_memory=2 ** 28,
+                         value_path=None):
+    # MA crossover over all symbols of store (a BarStore) in time chunks sized to max_memory.
+    # The value of every bar is written to value_path (.npy, read back with np.load(value_path, mmap_mode='r'))
+    # if given. Order records are kept in memory, they grow with the number of trades, not bars.
+    # Returns the order records (vectorbt's order_dt, same as pf.orders.values), the value map or None, and
+    # a summary per symbol, whose total_return and max_drawdown agree with the portfolio's up to rounding.
+    close_map = store.bars(interval, 'Close')
+    n_rows, n_cols = close_map.shape
+    chunk_len = max(1, int(max_memory // (n_cols * BYTES_PER_CELL)))
+    settings = vbt.settings.portfolio
+
+    # State carried across chunks
+    ma_state = [
+        (np.zeros(n_cols), np.zeros(n_cols), np.zeros((window, n_cols)), np.zeros((window, n_cols)))
+        for window in (fast_ma_period, slow_ma_period)
+    ]
+    was_below = np.full((2, n_cols), False)
+    crossed_ago = np.full((2, n_cols), -1)
+    sim_state = np.zeros((4, n_cols))
+    sim_state[[0, 3]] = settings['init_cash']
+    value_state = np.zeros((3, n_cols))
+    value_state[0] = settings['init_cash']
+    value_state[2] = np.nan
+    summary = np.zeros((5, n_cols))
+    summary[1] = -np.inf
+
+    value = None
+    if value_path is not None:
+        value = np.lib.format.open_memmap(value_path, mode='w+', dtype=np.float_, shape=(n_rows, n_cols))
+    order_records = []
+    for start in range(0, n_rows, chunk_len):
+        close = np.ascontiguousarray(close_map[start:start + chunk_len])
+        fast_ma = np.empty_like(close)
+        slow_ma = np.empty_like(close)
+        rolling_mean_chunk_nb(close, fast_ma_period, start, *ma_state[0], fast_ma)
+        rolling_mean_chunk_nb(close, slow_ma_period, start, *ma_state[1], slow_ma)
+        entries = np.empty(close.shape, dtype=np.bool_)
+        exits = np.empty(close.shape, dtype=np.bool_)
+        crossed_above_chunk_nb(fast_ma, slow_ma, was_below[0], crossed_ago[0], entries)
+        crossed_above_chunk_nb(slow_ma, fast_ma, was_below[1], crossed_ago[1], exits)
+
+        # At most one order per signal
+        chunk_records = np.empty(entries.sum() + exits.sum(), dtype=order_dt)
+        chunk_value = np.empty_like(close)
+        n_orders = simulate_chunk_nb(
+            close, entries, exits, start, sim_state, value_state, chunk_records, summary, chunk_value,
+            fees, settings['fixed_fees'], settings['slippage'], settings['min_size'], settings['max_size'],
+            settings['size_granularity'], settings['lock_cash'], settings['allow_partial']
+        )
+        order_records.append(chunk_records[:n_orders])
+        if value is not None:
+            value[start:start + len(close)] = chunk_value
+            value.flush()
+
+    # Column-major like the records of from_signals
+    order_records = np.concatenate(order_records) if len(order_records) > 0 else np.empty(0, dtype=order_dt)
+    order_records = order_records[np.lexsort((order_records['idx'], order_records['col']))]
+    order_records['id'] = np.arange(len(order_records))
+    summary = pd.DataFrame(
+        summary.T,
+        index=pd.Index(store.symbols(interval), name='symbol'),
+        columns=['end_value', 'peak_value', 'max_drawdown', 'total_orders', 'total_fees_paid']
+    )
+    summary.insert(0, 'start_value', settings['init_cash'])
+    summary.insert(2, 'total_return', (summary['end_value'] - summary['start_value']) / summary['start_value'])
+    summary['total_orders'] = summary['total_orders'].astype(np.int_)
+    return OutOfCoreResult(order_records, value, summary)
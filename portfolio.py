@@ -19,14 +19,20 @@ import pytz
 import vectorbt as vbt
 import numpy as np
 import pandas as pd
-from numba import njit
-from vectorbt.generic.nb import nanmean_nb
-from vectorbt.portfolio.nb import order_nb, sort_call_seq_nb
-from vectorbt.portfolio.enums import SizeType, Direction
-from pypfopt import expected_returns
-from pypfopt import risk_models
-from pypfopt.efficient_frontier import EfficientFrontier
-from pypfopt import base_optimizer
+from data_cache import OHLCVCache
+from render import minmax_positions, render_settings, rendering, set_render_mode, show
+from portfolio_metrics import portfolio_metrics
+from precision import set_precision, value_dtype
+from portfolio_nb import (
+    pre_sim_func_nb, pre_group_func_nb, find_weights_nb, sort_by_weights_nb, pre_segment_func_nb, order_func_nb,
+    post_segment_func_nb
+)
+from exposure import deployed_series, exposure_arrays, exposure_summary
+from result_store import ResultStore
+from weights_search import (
+    generate_weights, simulate_weights, simulate_metrics, value_returns, screen_weights, simulate_top_k, search_top_k,
+    simulate_candidates
+)
 
 # %%
 # Define params
@@ -34,15 +40,19 @@ symbols = ['AMZN', 'NFLX', 'GOOG', 'AAPL']
 start_date = datetime(2017, 1, 1, tzinfo=pytz.utc)
 end_date = datetime(2020, 1, 1, tzinfo=pytz.utc)
 num_tests = 2000
+seed = 42
 
 # %%
 vbt.settings.array_wrapper['freq'] = 'days'
 vbt.settings.returns['year_freq'] = '252 days'
 vbt.settings.portfolio['seed'] = 42
 vbt.settings.portfolio.stats['incl_unrealized'] = True
+set_render_mode('inline')  # 'off', 'file', 'inline' or 'queue' (background file writes)
+result_store = ResultStore()  # simulations below are read back on reruns with unchanged data and parameters
+set_precision('float64')  # 'float32' halves the memory of prices, weights and per-bar outputs, see precision.py
 
 # %%
-yfdata = vbt.YFData.download(symbols, start=start_date, end=end_date)
+yfdata = OHLCVCache().download(symbols, start=start_date, end=end_date)  # use OHLCVCache(offline=True) to never touch the network
 print(yfdata.symbols)
 
 # %% jupyter={"outputs_hidden": false}
@@ -58,7 +68,7 @@ price
 
 # %%
 # Plot normalized price series
-(price / price.iloc[0]).vbt.plot().show_png()
+show((price / price.iloc[0]).vbt.plot(), 'normalized_price')
 
 # %%
 returns = price.pct_change()
@@ -84,7 +94,7 @@ print(len(weights))
 
 # %%
 # Build column hierarchy such that one weight corresponds to one price series
-_price = price.vbt.tile(num_tests, keys=pd.Index(np.arange(num_tests), name='symbol_group'))
+_price = price.astype(value_dtype()).vbt.tile(num_tests, keys=pd.Index(np.arange(num_tests), name='symbol_group'))
 _price = _price.vbt.stack_index(pd.Index(np.concatenate(weights), name='weights'))
 print(_price.columns)
 
@@ -96,7 +106,8 @@ print(size.shape)
 
 # %%
 # Run simulation
-pf = vbt.Portfolio.from_orders(
+pf = result_store.run(
+    vbt.Portfolio.from_orders,
     close=_price,
     size=size,
     size_type='targetpercent',
@@ -105,15 +116,19 @@ pf = vbt.Portfolio.from_orders(
 )  # all weights sum to 1, no shorting, and 100% investment in risky assets
 print(len(pf.orders))
 
+# %%
+# Metrics of the 2000 groups are computed once, from returns computed once, and read from then on
+pf_metrics = portfolio_metrics(pf)
+sharpe = pf_metrics['sharpe_ratio']
+
 # %%
 # Plot annualized return against volatility, color by sharpe ratio
-annualized_return = pf.annualized_return()
-annualized_return.index = pf.annualized_volatility()
-annualized_return.vbt.scatterplot(
+annualized_return = pf_metrics['annualized_return'].set_axis(pf_metrics['annualized_volatility'])
+fig = annualized_return.vbt.scatterplot(
     trace_kwargs=dict(
         mode='markers',
         marker=dict(
-            color=pf.sharpe_ratio(),
+            color=sharpe,
             colorbar=dict(
                 title='sharpe_ratio'
             ),
@@ -123,15 +138,16 @@ annualized_return.vbt.scatterplot(
     ),
     xaxis_title='annualized_volatility',
     yaxis_title='annualized_return'
-).show_png()
+)
+show(fig, 'return_vs_volatility')
 
 # %% jupyter={"outputs_hidden": false}
-pf.sharpe_ratio()
+sharpe
 
 # %%
 # Get index of the best group according to the target metric
-best_symbol_group = pf.sharpe_ratio().idxmax()
-print(f'Best symbol group: {best_symbol_group} \nRelated Sharpe Ratio: {round(pf.sharpe_ratio()[best_symbol_group], 2)}')
+best_symbol_group = sharpe.idxmax()
+print(f'Best symbol group: {best_symbol_group} \nRelated Sharpe Ratio: {round(sharpe[best_symbol_group], 2)}')
 
 # %%
 # Print best weights
@@ -154,7 +170,8 @@ print(rb_size.shape)
 
 # %%
 # Run simulation, with re-balancing monthly
-rb_pf = vbt.Portfolio.from_orders(
+rb_pf = result_store.run(
+    vbt.Portfolio.from_orders,
     close=_price,
     size=rb_size,
     size_type='targetpercent',
@@ -165,8 +182,9 @@ rb_pf = vbt.Portfolio.from_orders(
 print(len(rb_pf.orders))
 
 # %%
-rb_best_symbol_group = rb_pf.sharpe_ratio().idxmax()
-print(f'Best re-balanced symbol group: {rb_best_symbol_group} \nRelated Sharpe Ratio: {round(rb_pf.sharpe_ratio()[rb_best_symbol_group], 2)}')
+rb_sharpe = portfolio_metrics(rb_pf)['sharpe_ratio']
+rb_best_symbol_group = rb_sharpe.idxmax()
+print(f'Best re-balanced symbol group: {rb_best_symbol_group} \nRelated Sharpe Ratio: {round(rb_sharpe[rb_best_symbol_group], 2)}')
 
 # %% jupyter={"outputs_hidden": false}
 [round(i, 4) for i in weights[rb_best_symbol_group]]
@@ -175,36 +193,100 @@ print(f'Best re-balanced symbol group: {rb_best_symbol_group} \nRelated Sharpe R
 print(rb_pf.iloc[rb_best_symbol_group].stats())
 
 
+# %% [markdown]
+"""
+# Zero-copy random search
+Same search as above, but the price matrix is kept once and only the weight matrix (num_tests x n_assets)
+is passed into the simulation, so every symbol group reads the same price buffer.
+"""
+
+# %%
+weights_matrix = np.array(weights)
+search_sharpe = value_returns(simulate_weights(price, weights_matrix)).sharpe_ratio()
+print(f'Best symbol group: {search_sharpe.idxmax()} \nRelated Sharpe Ratio: {round(search_sharpe.max(), 2)}')
+
+# %%
+rb_search_sharpe = value_returns(simulate_weights(price, weights_matrix, rb_mask=rb_mask)).sharpe_ratio()
+print(f'Best re-balanced symbol group: {rb_search_sharpe.idxmax()} \nRelated Sharpe Ratio: {round(rb_search_sharpe.max(), 2)}')
+
+# %%
+# Candidates are simulated in chunks and reduced to metrics right away, memory doesn't grow with their number
+big_weights = generate_weights(100_000, len(symbols))
+big_search_metrics = simulate_metrics(price, big_weights, rb_mask=rb_mask, ann_factor=returns.vbt.returns.ann_factor)
+print(big_weights[big_search_metrics['sharpe_ratio'].idxmax()])
+
+# %% [markdown]
+"""
+# Closed-form screening
+Without fees, each candidate's value path is the asset growth paths times its weights, compounded between
+re-balancing days. Screen a million candidates this way and run the full simulation only on the top K.
+"""
+
+# %%
+screen_weights_matrix = generate_weights(1_000_000, len(symbols))
+screened = screen_weights(price, screen_weights_matrix, rb_mask=rb_mask, ann_factor=returns.vbt.returns.ann_factor)
+top_pf = simulate_top_k(price, screen_weights_matrix, screened, k=10, rb_mask=rb_mask)
+top_sharpe = portfolio_metrics(top_pf)['sharpe_ratio']
+print(top_sharpe)
+
+# %%
+print(top_pf[top_sharpe.idxmax()].stats())  # groups are labeled by candidate index
+
 # %%
-def plot_allocation(rb_pf):
+def plot_allocation(rb_pf, name='allocation'):
     # Plot weights development of the portfolio
+    if not rendering():
+        return
     rb_asset_value = rb_pf.asset_value(group_by=False)
     rb_value = rb_pf.value()
     rb_idxs = np.flatnonzero((rb_pf.asset_flow() != 0).any(axis=1))
     rb_dates = rb_pf.wrapper.index[rb_idxs]
-    fig = (rb_asset_value.vbt / rb_value).vbt.plot(
+    rb_weights = rb_asset_value.vbt / rb_value
+    # Downsample rows shared by all assets, keeping each one's min/max shape
+    rb_weights = rb_weights.iloc[minmax_positions(rb_weights.values, render_settings['max_points'])]
+    fig = rb_weights.vbt.plot(
         trace_names=symbols,
         trace_kwargs=dict(
             stackgroup='one'
         )
     )
-    for rb_date in rb_dates:
-        fig.add_shape(
-            dict(
-                xref='x',
-                yref='paper',
-                x0=rb_date,
-                x1=rb_date,
-                y0=0,
-                y1=1,
-                line_color=fig.layout.template.layout.plot_bgcolor
-            )
+    # Add all re-balancing markers in one layout update
+    fig.update_layout(shapes=[
+        dict(
+            xref='x',
+            yref='paper',
+            x0=rb_date,
+            x1=rb_date,
+            y0=0,
+            y1=1,
+            line_color=fig.layout.template.layout.plot_bgcolor
         )
-    fig.show_png()
+        for rb_date in rb_dates
+    ])
+    show(fig, name)
 
 
 # %%
-plot_allocation(rb_pf.iloc[rb_best_symbol_group])  # best group
+plot_allocation(rb_pf.iloc[rb_best_symbol_group], 'rb_allocation')  # best group
+
+
+# %% [markdown]
+"""
+# Streaming top-K search
+Generate, simulate and score candidates in batches, keeping only the K best with their weights and seeds,
+so memory doesn't grow with the number of candidates. Only the winners are simulated again in full.
+"""
+
+# %%
+top_k = search_top_k(price, 1_000_000, k=10, rb_mask=rb_mask, seed=seed, ann_factor=returns.vbt.returns.ann_factor)
+print(top_k)
+
+# %%
+top_k_pf = simulate_candidates(price, top_k[symbols].values, top_k.index, rb_mask=rb_mask)
+print(top_k_pf[top_k.index[0]].stats())
+
+# %%
+plot_allocation(top_k_pf[top_k.index[0]], 'top_k_allocation')
 
 
 # %% [markdown]
@@ -213,6 +295,7 @@ plot_allocation(rb_pf.iloc[rb_best_symbol_group])  # best group
 Utilize low-level API to dynamically search for best Sharpe ratio and re-balance accordingly.
 Compared to previous method, we won't utilize stacking, but do search in a loop instead. 
 We also will use days instead of months, as latter may contain a various number of trading days.
+The Numba callbacks of this simulation live in portfolio_nb.py.
 """
 
 # %%
@@ -224,98 +307,43 @@ ann_factor = returns.vbt.returns.ann_factor
 ann_factor
 
 # %%
-@njit
-def pre_sim_func_nb(c, every_nth):
-    # Define re-balancing days
-    c.segment_mask[:, :] = False
-    c.segment_mask[every_nth::every_nth, :] = True
-    return ()
-
-# %%
-@njit
-def find_weights_nb(c, price, num_tests):
-    # Find optimal weights based on best Sharpe ratio
-    returns = (price[1:] - price[:-1]) / price[:-1]
-    returns = returns[1:, :]  # cannot compute np.cov with NaN
-    mean = nanmean_nb(returns)
-    cov = np.cov(returns, rowvar=False)  # masked arrays not supported by Numba (yet)
-    best_sharpe_ratio = -np.inf
-    weights = np.full(c.group_len, np.nan, dtype=np.float_)
-
-    for i in range(num_tests):
-        # Generate weights
-        w = np.random.random_sample(c.group_len)
-        w = w / np.sum(w)
-
-        # Compute annualized mean, covariance, and Sharpe ratio
-        p_return = np.sum(mean * w) * ann_factor
-        p_std = np.sqrt(np.dot(w.T, np.dot(cov, w))) * np.sqrt(ann_factor)
-        sharpe_ratio = p_return / p_std
-        if sharpe_ratio > best_sharpe_ratio:
-            best_sharpe_ratio = sharpe_ratio
-            weights = w
-
-    return best_sharpe_ratio, weights
-
-# %%
-@njit
-def pre_segment_func_nb(c, find_weights_nb, history_len, num_tests, srb_sharpe):
-    if history_len == -1:
-        # Look back at the entire time period
-        close = c.close[:c.i, c.from_col:c.to_col]
-    else:
-        # Look back at a fixed time period
-        if c.i - history_len <= 0:
-            return (np.full(c.group_len, np.nan),)  # insufficient data
-        close = c.close[c.i - history_len:c.i, c.from_col:c.to_col]
-
-    # Find optimal weights
-    best_sharpe_ratio, weights = find_weights_nb(c, close, num_tests)
-    srb_sharpe[c.i] = best_sharpe_ratio
-
-    # Update valuation price and reorder orders
-    size_type = SizeType.TargetPercent
-    direction = Direction.LongOnly
-    order_value_out = np.empty(c.group_len, dtype=np.float_)
-    for k in range(c.group_len):
-        col = c.from_col + k
-        c.last_val_price[col] = c.close[c.i, col]
-    sort_call_seq_nb(c, weights, size_type, direction, order_value_out)
-
-    return (weights,)
-
-# %%
-@njit
-def order_func_nb(c, weights):
-    col_i = c.call_seq_now[c.call_idx]
-    return order_nb(
-        weights[col_i],
-        c.close[c.i, c.col],
-        size_type=SizeType.TargetPercent
-    )
+# Capital exposure is accumulated during the simulation instead of rebuilt from asset_value() and value()
+srb_exposure, srb_deployed = exposure_arrays(price.shape[0], 1, per_bar=True)
 
 # %%
 # Run simulation using a custom order function
-srb_pf = vbt.Portfolio.from_order_func(
+srb_pf = result_store.run(
+    vbt.Portfolio.from_order_func,
     price,
     order_func_nb,
     pre_sim_func_nb=pre_sim_func_nb,
     pre_sim_args=(30,),
+    pre_group_func_nb=pre_group_func_nb,
     pre_segment_func_nb=pre_segment_func_nb,
-    pre_segment_args=(find_weights_nb, -1, ann_factor, num_tests, srb_sharpe),
+    pre_segment_args=(find_weights_nb, -1, ann_factor, num_tests, seed, srb_sharpe),
+    post_segment_func_nb=post_segment_func_nb,
+    post_segment_args=(srb_exposure, srb_deployed),
+    call_pre_segment=True,
+    call_post_segment=True,
     cash_sharing=True,
-    group_by=True
+    group_by=True,
+    # filled by the simulation, restored when read back
+    outputs=dict(srb_sharpe=srb_sharpe, srb_exposure=srb_exposure, srb_deployed=srb_deployed)
 )
 
 # %%
 # Plot the best Sharpe ratio at each re-balancing day
-pd.Series(srb_sharpe, index=price.index).vbt.scatterplot(trace_kwargs=dict(mode='markers')).show_png()
+show(pd.Series(srb_sharpe, index=price.index).vbt.scatterplot(trace_kwargs=dict(mode='markers')), 'srb_sharpe')
 
 # %%
 print(srb_pf.stats())
 
 # %%
-plot_allocation(srb_pf)
+print(exposure_summary(srb_pf.wrapper, srb_exposure))
+show(deployed_series(srb_pf.wrapper, srb_deployed).vbt.plot(), 'srb_deployed')
+
+# %%
+plot_allocation(srb_pf, 'srb_allocation')
 
 # %%
 # You can see how weights stabilize themselves with growing data.
@@ -323,27 +351,37 @@ plot_allocation(srb_pf)
 srb252_sharpe = np.full(price.shape[0], np.nan)
 
 # %%
-srb252_pf = vbt.Portfolio.from_order_func(
+srb252_pf = result_store.run(
+    vbt.Portfolio.from_order_func,
     price,
     order_func_nb,
     pre_sim_func_nb=pre_sim_func_nb,
     pre_sim_args=(30,),
+    pre_group_func_nb=pre_group_func_nb,
     pre_segment_func_nb=pre_segment_func_nb,
-    pre_segment_args=(find_weights_nb, 252, ann_factor, num_tests, srb252_sharpe),
+    pre_segment_args=(find_weights_nb, 252, ann_factor, num_tests, seed, srb252_sharpe),
+    call_pre_segment=True,
     cash_sharing=True,
-    group_by=True
+    group_by=True,
+    outputs=dict(srb252_sharpe=srb252_sharpe)
 )
-pd.Series(srb252_sharpe, index=price.index).vbt.scatterplot(trace_kwargs=dict(mode='markers')).show_png()
+show(pd.Series(srb252_sharpe, index=price.index).vbt.scatterplot(trace_kwargs=dict(mode='markers')), 'srb252_sharpe')
 
 # %%
-print(srb252_pf.sta())
+print(srb252_pf.stats())
 
 # %%
-plot_allocation(srb252_pf)
+plot_allocation(srb252_pf, 'srb252_allocation')
 
 # %%
 # A much more volatile weight distribution.
 # PyPortfolioOpt + vectorbt
+# PyPortfolioOpt is slow to import, so it's only imported once the notebook gets here
+from pypfopt import expected_returns
+from pypfopt import risk_models
+from pypfopt.efficient_frontier import EfficientFrontier
+from pypfopt import base_optimizer
+
 # One-time allocation
 # Calculate expected returns and sample covariance matrix
 avg_returns = expected_returns.mean_historical_return(price)
@@ -362,7 +400,8 @@ print(pyopt_size.shape)
 
 # %%
 # Run simulation with weights from PyPortfolioOpt
-pyopt_pf = vbt.Portfolio.from_orders(
+pyopt_pf = result_store.run(
+    vbt.Portfolio.from_orders,
     close=price,
     size=pyopt_size,
     size_type='targetpercent',
@@ -386,7 +425,7 @@ We will demonstrate the second option.
 
 
 # %%
-def pyopt_find_weights(sc, price, num_tests):  # no @njit decorator = it's a pure Python function
+def pyopt_find_weights(sc, price, ann_factor, num_tests):  # no @njit decorator = it's a pure Python function
     # Calculate expected returns and sample covariance matrix
     price = pd.DataFrame(price, columns=symbols)
     avg_returns = expected_returns.mean_historical_return(price)
@@ -402,29 +441,87 @@ def pyopt_find_weights(sc, price, num_tests):  # no @njit decorator = it's a pur
     return best_sharpe_ratio, weights
 
 
+# %%
+def pyopt_pre_segment_func(c, find_weights, history_len, ann_factor, num_tests, srb_sharpe):
+    # PyPortfolioOpt needs the price window itself rather than running moments
+    if history_len == -1:
+        # Look back at the entire time period
+        close = c.close[:c.i, c.from_col:c.to_col]
+    else:
+        # Look back at a fixed time period
+        if c.i - history_len <= 0:
+            return (np.full(c.group_len, np.nan),)  # insufficient data
+        close = c.close[c.i - history_len:c.i, c.from_col:c.to_col]
+
+    # Find optimal weights
+    best_sharpe_ratio, weights = find_weights(c, close, ann_factor, num_tests)
+    srb_sharpe[c.i] = best_sharpe_ratio
+    sort_by_weights_nb(c, weights)
+
+    return (weights,)
+
+
 # %%
 pyopt_srb_sharpe = np.full(price.shape[0], np.nan)
 
 # %%
 # Run simulation with a custom order function
-pyopt_srb_pf = vbt.Portfolio.from_order_func(
+pyopt_srb_pf = result_store.run(
+    vbt.Portfolio.from_order_func,
     price,
     order_func_nb,
     pre_sim_func_nb=pre_sim_func_nb,
     pre_sim_args=(30,),
-    pre_segment_func_nb=pre_segment_func_nb.py_func,  # run pre_segment_func_nb as pure Python function
+    pre_segment_func_nb=pyopt_pre_segment_func,  # pure Python function
     pre_segment_args=(pyopt_find_weights, -1, ann_factor, num_tests, pyopt_srb_sharpe),
     cash_sharing=True,
     group_by=True,
-    use_numba=False  # run simulate_nb as pure Python function
+    use_numba=False,  # run simulate_nb as pure Python function
+    outputs=dict(pyopt_srb_sharpe=pyopt_srb_sharpe)
 )
 
 # %%
-pd.Series(pyopt_srb_sharpe, index=price.index).vbt.scatterplot(trace_kwargs=dict(mode='markers')).show_png()
+show(pd.Series(pyopt_srb_sharpe, index=price.index).vbt.scatterplot(trace_kwargs=dict(mode='markers')), 'pyopt_srb_sharpe')
 
 # %%
 print(pyopt_srb_pf.stats())
 
 
 # %%
-plot_allocation(pyopt_srb_pf)
+plot_allocation(pyopt_srb_pf, 'pyopt_srb_allocation')
+
+
+# %% [markdown]
+"""
+# Solve windows in parallel, simulate in Numba
+Instead of disabling Numba for the whole simulation, first solve every re-balancing window with PyPortfolioOpt
+in a process pool, then feed the resulting target weights into a compiled simulation.
+"""
+
+# %%
+if __name__ == '__main__':
+    # Process pools re-import this script in their workers (spawn/forkserver), only start them from the main process
+    from pyopt_rebalance import pyopt_target_weights
+
+    pyopt_rb_size, pyopt_rb_sharpe = pyopt_target_weights(price, every_nth=30, history_len=-1)
+    pyopt_rb_pf = result_store.run(
+        vbt.Portfolio.from_orders,
+        close=price,
+        size=pyopt_rb_size,
+        size_type='targetpercent',
+        group_by=True,
+        cash_sharing=True,
+        call_seq='auto'  # important: sell before buy
+    )
+
+# %%
+if __name__ == '__main__':
+    show(pd.Series(pyopt_rb_sharpe, index=price.index).vbt.scatterplot(trace_kwargs=dict(mode='markers')), 'pyopt_rb_sharpe')
+
+# %%
+if __name__ == '__main__':
+    print(pyopt_rb_pf.stats())
+
+# %%
+if __name__ == '__main__':
+    plot_allocation(pyopt_rb_pf, 'pyopt_rb_allocation')
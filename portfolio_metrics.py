@@ -0,0 +1,113 @@
+import pandas as pd
+import vectorbt as vbt
+from vectorbt.base.reshape_fns import to_1d_array, to_2d_array
+from vectorbt.portfolio.base import returns_acc_config
+from vectorbt.returns.nb import returns_nb
+
+# Memoized, selective metrics over a simulated portfolio, for sweeps that read the same metric many times
+# (plot colour, idxmax, printing) and need only a few of the ~30 stats:
+#   metrics = portfolio_metrics(pf)
+#   sharpe = metrics['sharpe_ratio']  # value and returns are computed once and shared by all metrics
+#   metrics.stats(['total_return', 'max_dd', 'sharpe_ratio'])  # the other stats are never computed
+# Values are kept as long as the portfolio is alive (pf.iloc[...] is a new portfolio with its own values),
+# and dropped when the vbt settings they depend on change.
+# This doesn't rely on vbt's global cache, so it can be disabled for large sweeps to not keep every
+# intermediate of every portfolio: vbt.settings.caching['enabled'] = False
+# Returned metrics are shared, copy them before modifying in place.
+
+# Metrics of the returns accessor that need benchmark returns, taken from the portfolio itself
+BENCHMARK_METRICS = ('information_ratio', 'beta', 'alpha', 'capture', 'up_capture', 'down_capture')
+
+
+def _settings_key():
+    # Everything outside the portfolio that metrics and stats read at call time
+    return (
+        vbt.settings.array_wrapper['freq'],
+        repr(vbt.settings.returns),
+        repr(vbt.settings.portfolio['stats'])
+    )
+
+
+def metric_names(pf, metrics='all'):
+    if isinstance(metrics, str):
+        return list(pf.metrics) if metrics == 'all' else [metrics]
+    return list(metrics)
+
+
+def stat_titles(pf, metrics='all'):
+    # Stats field of each metric name, e.g. 'sharpe_ratio' -> 'Sharpe Ratio'
+    return [pf.metrics[name].get('title', name) for name in metric_names(pf, metrics)]
+
+
+class PortfolioMetrics:
+    def __init__(self, pf):
+        self.pf = pf
+        self._cache = {}
+        self._stats = {}
+        self._settings = _settings_key()
+
+    def _check_settings(self):
+        settings = _settings_key()
+        if settings != self._settings:
+            self._cache.clear()
+            self._stats.clear()
+            self._settings = settings
+
+    def _get(self, key, func):
+        self._check_settings()
+        if key not in self._cache:
+            self._cache[key] = func()
+        return self._cache[key]
+
+    def value(self):
+        return self._get(('value',), self.pf.value)
+
+    def returns(self):
+        # Same as pf.returns(), from the shared value
+        def func():
+            returns = returns_nb(to_2d_array(self.value()), to_1d_array(self.pf.init_cash))
+            return self.pf.wrapper.wrap(returns)
+        return self._get(('returns',), func)
+
+    def returns_acc(self):
+        return self._get(('returns_acc',), lambda: self.returns().vbt.returns(freq=self.pf.wrapper.freq))
+
+    def get(self, name, **kwargs):
+        # Any metric method of the portfolio by name, e.g. get('sharpe_ratio', risk_free=0.01).
+        # kwargs must be hashable, they are part of the cache key.
+        def func():
+            if name in returns_acc_config and name not in BENCHMARK_METRICS:
+                source_name = returns_acc_config[name].get('source_name', name)
+                return getattr(self.returns_acc(), source_name)(**kwargs)
+            return getattr(self.pf, name)(**kwargs)
+        return self._get((name, tuple(sorted(kwargs.items()))), func)
+
+    def __getitem__(self, name):
+        return self.get(name)
+
+    def stats(self, metrics='all', column=None, agg_func=None):
+        # Only the requested stats (names of pf.metrics) are computed, each of them once per column/agg_func.
+        # The default agg_func=None returns one row per column/group, like pf.stats(agg_func=None).
+        self._check_settings()
+        metrics = metric_names(self.pf, metrics)
+        key = (column, agg_func)
+        done, out = self._stats.get(key, (set(), None))
+        missing = [name for name in metrics if name not in done]
+        if len(missing) > 0:
+            new = self.pf.stats(metrics=missing, column=column, agg_func=agg_func)
+            out = new if out is None else pd.concat([out, new], axis=new.ndim - 1)
+            done = done | set(missing)
+            self._stats[key] = (done, out)
+        # Metrics filtered out by vbt (e.g. no trades to compute them from) have no field
+        fields = out.columns if out.ndim == 2 else out.index
+        titles = [title for title in stat_titles(self.pf, metrics) if title in fields]
+        return out[titles]
+
+
+def portfolio_metrics(pf):
+    # The metrics of pf, kept on pf itself so that every caller shares them and they go away with it
+    metrics = pf.__dict__.get('_portfolio_metrics')
+    if metrics is None:
+        metrics = PortfolioMetrics(pf)
+        pf._portfolio_metrics = metrics
+    return metrics
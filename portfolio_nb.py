@@ -0,0 +1,133 @@
+import numpy as np
+from numba import njit, prange
+from vectorbt.portfolio.enums import SizeType, Direction
+from vectorbt.portfolio.nb import order_nb, sort_call_seq_nb
+
+from exposure import update_exposure_nb
+
+# Kernels of the "search and re-balance every 30 days" simulation in portfolio.py.
+# Compiled code is cached on disk, run `python warmup.py` once to fill the cache.
+
+
+@njit(cache=True)
+def pre_sim_func_nb(c, every_nth):
+    # Define re-balancing days
+    c.segment_mask[:, :] = False
+    c.segment_mask[every_nth::every_nth, :] = True
+    return ()
+
+
+@njit(cache=True)
+def pre_group_func_nb(c):
+    # Running sums of returns, their cross-products and count, updated once per bar
+    ret_sum = np.zeros(c.group_len, dtype=np.float_)
+    ret_prod = np.zeros((c.group_len, c.group_len), dtype=np.float_)
+    ret_count = np.zeros(1, dtype=np.int_)
+    return ret_sum, ret_prod, ret_count
+
+
+@njit(cache=True)
+def update_moments_nb(c, ret_sum, ret_prod, ret_count, i, sign):
+    # Add (sign=1) or remove (sign=-1) the return of bar i
+    r = c.close[i, c.from_col:c.to_col] / c.close[i - 1, c.from_col:c.to_col] - 1
+    ret_sum += sign * r
+    ret_prod += sign * np.outer(r, r)
+    ret_count[0] += sign
+
+
+@njit(cache=True)
+def stream_seed_nb(seed, i, k):
+    # Seed of the k-th random stream at bar i, independent of call order and thread scheduling
+    return (seed * 1000003 + i * 7919 + k) % 4294967296
+
+
+@njit(cache=True)
+def score_chunk_nb(mean, cov, ann_factor, size, chunk_seed):
+    # Generate a block of candidates from its own random stream and return the best one
+    np.random.seed(chunk_seed)
+    w = np.random.random_sample((size, mean.shape[0]))
+    w = w / np.sum(w, axis=1).reshape((-1, 1))
+
+    # Annualized return with one matrix product, variance as a row-wise quadratic form
+    p_return = np.dot(w, mean) * ann_factor
+    p_std = np.sqrt(np.sum(np.dot(w, cov) * w, axis=1)) * np.sqrt(ann_factor)
+    sharpe_ratio = p_return / p_std
+    best = np.argmax(sharpe_ratio)
+    return sharpe_ratio[best], w[best].copy()
+
+
+@njit(parallel=True, cache=True)
+def best_weights_nb(mean, cov, ann_factor, num_tests, seed, i, chunk_len):
+    # Score candidate chunks in parallel, results don't depend on the number of threads
+    n_chunks = (num_tests + chunk_len - 1) // chunk_len
+    chunk_sharpe = np.full(n_chunks, -np.inf)
+    chunk_weights = np.full((n_chunks, mean.shape[0]), np.nan)
+
+    for k in prange(n_chunks):
+        size = min(chunk_len, num_tests - k * chunk_len)
+        sharpe_ratio, w = score_chunk_nb(mean, cov, ann_factor, size, stream_seed_nb(seed, i, k))
+        chunk_sharpe[k] = sharpe_ratio
+        chunk_weights[k, :] = w
+
+    best = np.argmax(chunk_sharpe)
+    return chunk_sharpe[best], chunk_weights[best].copy()
+
+
+@njit(cache=True)
+def find_weights_nb(c, mean, cov, ann_factor, num_tests, seed):
+    # Find optimal weights based on best Sharpe ratio
+    return best_weights_nb(mean, cov, ann_factor, num_tests, seed, c.i, 1024)
+
+
+@njit(cache=True)
+def sort_by_weights_nb(c, weights):
+    # Update valuation price and reorder orders
+    size_type = SizeType.TargetPercent
+    direction = Direction.LongOnly
+    order_value_out = np.empty(c.group_len, dtype=np.float_)
+    for k in range(c.group_len):
+        col = c.from_col + k
+        c.last_val_price[col] = c.close[c.i, col]
+    sort_call_seq_nb(c, weights, size_type, direction, order_value_out)
+
+
+@njit(cache=True)
+def pre_segment_func_nb(c, ret_sum, ret_prod, ret_count, find_weights_nb, history_len, ann_factor, num_tests,
+                        seed, srb_sharpe):
+    # Called on every bar (call_pre_segment=True) to keep the moments of the look-back window up to date
+    if c.i >= 2:
+        update_moments_nb(c, ret_sum, ret_prod, ret_count, c.i - 1, 1)
+        if history_len != -1 and c.i - history_len >= 1:
+            # Look back at a fixed time period: drop the return that left the window
+            update_moments_nb(c, ret_sum, ret_prod, ret_count, c.i - history_len, -1)
+    if not c.segment_mask[c.i, c.group]:
+        return (np.full(c.group_len, np.nan),)  # no re-balancing today
+    if (history_len != -1 and c.i - history_len <= 0) or ret_count[0] < 2:
+        return (np.full(c.group_len, np.nan),)  # insufficient data
+
+    # Mean and sample covariance of the window in O(n_assets^2)
+    mean = ret_sum / ret_count[0]
+    cov = (ret_prod - ret_count[0] * np.outer(mean, mean)) / (ret_count[0] - 1)
+
+    # Find optimal weights
+    best_sharpe_ratio, weights = find_weights_nb(c, mean, cov, ann_factor, num_tests, seed)
+    srb_sharpe[c.i] = best_sharpe_ratio
+    sort_by_weights_nb(c, weights)
+
+    return (weights,)
+
+
+@njit(cache=True)
+def order_func_nb(c, weights):
+    col_i = c.call_seq_now[c.call_idx]
+    return order_nb(
+        weights[col_i],
+        c.close[c.i, c.col],
+        size_type=SizeType.TargetPercent
+    )
+
+
+@njit(cache=True)
+def post_segment_func_nb(c, ret_sum, ret_prod, ret_count, exposure_out, deployed_out):
+    # Track capital exposure at the close of every bar (call_post_segment=True)
+    update_exposure_nb(c, exposure_out, deployed_out)
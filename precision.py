@@ -0,0 +1,103 @@
+import sys
+
+import numpy as np
+import pandas as pd
+from numba import njit
+
+# Opt-in compact mode for large sweeps, which run out of memory long before they run out of CPU:
+#   set_precision('float32')
+# stores prices, weights and per-bar outputs in float32, half the memory of float64, while cash, positions
+# and every accumulation stay float64. Signal matrices passed into kernels are packed 8 per byte (pack_mask),
+# which is lossless and therefore not tied to the mode.
+#   python precision.py
+# checks that the metrics in float32 stay within TOLERANCES of the float64 results.
+precision_settings = dict(
+    dtype='float64'
+)
+
+# Largest absolute difference from float64 allowed per metric of metrics.METRICS (returns are fractions)
+TOLERANCES = dict(
+    total_return=1e-5,
+    annualized_return=1e-5,
+    annualized_volatility=1e-5,
+    sharpe_ratio=1e-4,
+    sortino_ratio=1e-4,
+    max_drawdown=1e-5,
+    max_drawdown_duration=1
+)
+
+
+def set_precision(dtype):
+    if dtype not in ('float64', 'float32'):
+        raise ValueError(f"Unknown precision '{dtype}'")
+    precision_settings.update(dtype=dtype)
+
+
+def value_dtype():
+    # dtype of prices, weights and per-bar outputs
+    return np.dtype(precision_settings['dtype'])
+
+
+def pack_mask(mask):
+    # Boolean matrix (n_rows, n_cols) -> uint8 matrix (n_rows, ceil(n_cols / 8)), read with mask_bit_nb
+    mask = np.asarray(mask, dtype=np.bool_)
+    return np.packbits(mask.reshape((mask.shape[0], -1)), axis=1)
+
+
+def unpack_mask(bits, n_cols):
+    return np.unpackbits(bits, axis=1, count=n_cols).astype(np.bool_)
+
+
+@njit(cache=True)
+def mask_bit_nb(bits, i, col):
+    return ((bits[i, col >> 3] >> (7 - (col & 7))) & 1) == 1
+
+
+def precision_report(price, num_tests=1000, rb_mask=None, ann_factor=252., seed=42, fees=0.001):
+    # Metrics of num_tests random allocations in both modes, simulated (weights_search.simulate_weights) and
+    # screened (weights_search.screen_weights, fee-free), with the largest difference of each metric
+    from metrics import returns_metrics
+    from weights_search import generate_weights, screen_weights, simulate_weights, value_returns
+
+    weights = generate_weights(num_tests, price.shape[1], seed=seed)
+    simulated, screened = {}, {}
+    prev_dtype = precision_settings['dtype']
+    try:
+        for dtype in ('float64', 'float32'):
+            set_precision(dtype)
+            value = simulate_weights(price, weights, rb_mask=rb_mask, fees=fees)
+            simulated[dtype] = returns_metrics(value_returns(value).obj, ann_factor)
+            screened[dtype] = screen_weights(price, weights, rb_mask=rb_mask, ann_factor=ann_factor)
+    finally:
+        set_precision(prev_dtype)
+    diff = pd.concat({
+        name: (metrics['float32'] - metrics['float64']).abs().max()
+        for name, metrics in (('simulate', simulated), ('screen', screened))
+    }, names=['source', 'metric'])
+    report = pd.DataFrame(dict(max_abs_diff=diff, tolerance=diff.index.get_level_values('metric').map(TOLERANCES)))
+    report['ok'] = report['max_abs_diff'] <= report['tolerance']
+    return report
+
+
+def check_precision(price, **kwargs):
+    # Raises if any metric in float32 is out of tolerance
+    report = precision_report(price, **kwargs)
+    if not report['ok'].all():
+        raise AssertionError(f"float32 metrics out of tolerance:\n{report[~report['ok']]}")
+    return report
+
+
+if __name__ == '__main__':
+    # The mode must be set on the module that simulate_weights reads it from, not on __main__
+    from precision import precision_report
+    from synthetic import correlated_gbm
+
+    ok = True
+    for n_rows, n_assets in ((750, 4), (5000, 20)):
+        price = correlated_gbm(n_rows, n_assets)
+        rb_mask = ~price.index.tz_localize(None).to_period('m').duplicated()
+        for name, mask in (('buy and hold', None), ('monthly re-balancing', rb_mask)):
+            report = precision_report(price, rb_mask=mask)
+            print(f'{n_rows} rows x {n_assets} assets, {name}:\n{report}\n')
+            ok &= bool(report['ok'].all())
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,85 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+from pypfopt import expected_returns
+from pypfopt import risk_models
+from pypfopt.efficient_frontier import EfficientFrontier
+from pypfopt import base_optimizer
+from pypfopt.exceptions import OptimizationError
+
+from shared_data import SharedFrame, attach
+
+_price = None
+
+
+def _init_worker(handle):
+    # Workers map the published price instead of receiving a pickled copy
+    global _price
+    _price = attach(handle)
+
+
+def max_sharpe_weights(price):
+    # Calculate expected returns and sample covariance matrix
+    avg_returns = expected_returns.mean_historical_return(price)
+    cov_mat = risk_models.sample_cov(price)
+
+    # Get weights maximizing the Sharpe ratio
+    ef = EfficientFrontier(avg_returns, cov_mat)
+    ef.max_sharpe()
+    clean_weights = ef.clean_weights()
+    weights = np.array([clean_weights[symbol] for symbol in price.columns])
+    best_sharpe_ratio = base_optimizer.portfolio_performance(weights, avg_returns, cov_mat)[2]
+    return best_sharpe_ratio, weights
+
+
+def _solve_chunk(idxs, history_len):
+    # Solve the re-balancing days of a chunk, NaN weights for windows without a solution
+    # (e.g. no asset beats the risk-free rate), they are filled in date order by the parent
+    out = []
+    for i in idxs:
+        window = _price.iloc[:i] if history_len == -1 else _price.iloc[i - history_len:i]
+        try:
+            best_sharpe_ratio, weights = max_sharpe_weights(window)
+        except (OptimizationError, ValueError):
+            best_sharpe_ratio, weights = np.nan, np.full(_price.shape[1], np.nan)
+        out.append((i, best_sharpe_ratio, weights))
+    return out
+
+
+def rebalance_idxs(n_rows, every_nth, history_len=-1):
+    # Same days as pre_sim_func_nb, minus those without enough history
+    idxs = np.arange(every_nth, n_rows, every_nth)
+    if history_len != -1:
+        idxs = idxs[idxs - history_len > 0]
+    return idxs
+
+
+def pyopt_target_weights(price, every_nth=30, history_len=-1, n_jobs=None, chunk_len=None):
+    # Phase one: solve every re-balancing window in a process pool.
+    # Returns a target weight matrix (NaN = no order) and the Sharpe ratio at each re-balancing day
+    # (NaN where the window has no solution).
+    idxs = rebalance_idxs(price.shape[0], every_nth, history_len)
+    n_jobs = os.cpu_count() if n_jobs is None else n_jobs
+    if chunk_len is None:
+        chunk_len = max(1, int(np.ceil(len(idxs) / (4 * n_jobs))))
+    chunks = [idxs[k:k + chunk_len] for k in range(0, len(idxs), chunk_len)]
+
+    with SharedFrame(price) as shared, \
+            ProcessPoolExecutor(n_jobs, initializer=_init_worker, initargs=(shared.handle,)) as executor:
+        results = executor.map(_solve_chunk, chunks, repeat(history_len))
+
+        size = np.full(price.shape, np.nan)
+        sharpe = np.full(price.shape[0], np.nan)
+        for chunk in results:
+            for i, best_sharpe_ratio, weights in chunk:
+                size[i] = weights
+                sharpe[i] = best_sharpe_ratio
+
+    # A window without a solution re-balances to the previous day's weights, only after all chunks are
+    # collected so that the result doesn't depend on chunk_len or n_jobs
+    if len(idxs) > 0:
+        size[idxs] = pd.DataFrame(size[idxs]).ffill().values
+    return size, sharpe
@@ -0,0 +1,103 @@
+import atexit
+import os
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import numpy as np
+
+# mode: 'off' (don't render), 'file' (write PNGs), 'inline' (show PNGs) or 'queue' (write PNGs in background,
+# one at a time: kaleido exports through a single shared subprocess that isn't thread-safe)
+render_settings = dict(
+    mode='inline',
+    output_dir='charts',
+    max_points=5000
+)
+_executor = None
+_futures = []
+
+
+def set_render_mode(mode, **kwargs):
+    if mode not in ('off', 'file', 'inline', 'queue'):
+        raise ValueError(f"Unknown render mode '{mode}'")
+    render_settings.update(mode=mode, **kwargs)
+
+
+def rendering():
+    return render_settings['mode'] != 'off'
+
+
+def minmax_positions(values, max_points):
+    # Row positions that keep the min and max of each bin (union across columns) plus the first and last row,
+    # so the shape of the series survives downsampling
+    values = np.asarray(values, dtype=np.float_).reshape((len(values), -1))
+    n_rows = values.shape[0]
+    if n_rows <= max_points:
+        return np.arange(n_rows)
+    n_bins = max(1, max_points // (2 * values.shape[1]))
+    bins = np.linspace(0, n_rows, n_bins + 1).astype(np.int_)
+    filled = np.where(np.isnan(values), np.nanmean(values, axis=0), values)
+    positions = [np.array([0, n_rows - 1])]
+    for op in (np.minimum, np.maximum):
+        extreme = op.reduceat(filled, bins[:-1], axis=0)
+        # Position of the extreme within each bin
+        is_extreme = filled == np.repeat(extreme, np.diff(bins), axis=0)
+        bin_ids = np.repeat(np.arange(n_bins), np.diff(bins))
+        for col in range(values.shape[1]):
+            rows = np.flatnonzero(is_extreme[:, col])
+            if len(rows) == 0:
+                continue  # all-NaN column
+            positions.append(rows[np.r_[True, bin_ids[rows][1:] != bin_ids[rows][:-1]]])
+    return np.unique(np.concatenate(positions))
+
+
+def downsample_fig(fig, max_points):
+    # Downsample long line traces in place; stacked traces share x, so they are left to the caller
+    for trace in fig.data:
+        y = getattr(trace, 'y', None)
+        if y is None or len(y) <= max_points or getattr(trace, 'stackgroup', None) is not None:
+            continue
+        if getattr(trace, 'mode', None) == 'markers':
+            continue  # every marker is a data point, not a line shape
+        try:
+            positions = minmax_positions(y, max_points)
+        except (TypeError, ValueError):
+            continue  # non-numeric trace
+        trace.y = np.asarray(y)[positions]
+        # Without x, plotly draws y at 0..n-1: keep the original positions so kept points stay in place
+        trace.x = positions if trace.x is None else np.asarray(trace.x)[positions]
+    return fig
+
+
+def _write(fig, path):
+    fig.write_image(path)
+    return path
+
+
+def show(fig, name):
+    # Render a figure according to the current mode
+    mode = render_settings['mode']
+    if mode == 'off':
+        return
+    downsample_fig(fig, render_settings['max_points'])
+    if mode == 'inline':
+        fig.show_png()
+        return
+    os.makedirs(render_settings['output_dir'], exist_ok=True)
+    path = os.path.join(render_settings['output_dir'], f'{name}.png')
+    if mode == 'file':
+        _write(fig, path)
+    else:
+        global _executor
+        if _executor is None:
+            _executor = ThreadPoolExecutor(1)
+        _futures.append(_executor.submit(_write, fig, path))
+
+
+def wait_renders():
+    # Block until all queued renders are written, re-raising the first failure
+    done, _ = wait(_futures)
+    _futures.clear()
+    for future in done:
+        future.result()
+
+
+atexit.register(wait_renders)
@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+
+# How each OHLCV feature is aggregated into a higher timeframe bar
+AGGREGATIONS = {
+    'Open': 'first',
+    'High': np.fmax,
+    'Low': np.fmin,
+    'Close': 'last',
+    'Volume': np.add
+}
+FREQS = {
+    '1h': '1h',
+    '4h': '4h',
+    '1d': '1D'
+}
+
+
+def bar_labels(index, timeframe):
+    # Open time of the higher timeframe bar each base bar belongs to
+    if timeframe in ('1w', '1wk'):
+        return (index - pd.to_timedelta(index.dayofweek, unit='D')).floor('1D')  # weeks start on Monday
+    return index.floor(FREQS[timeframe])
+
+
+def _wrap(values, index, like):
+    if isinstance(like, pd.DataFrame):
+        return pd.DataFrame(values, index=index, columns=like.columns)
+    return pd.Series(values, index=index, name=like.name)
+
+
+class Resampler:
+    # Builds higher timeframes from one base OHLCV series, memoized per timeframe.
+    # data is either an OHLCV DataFrame of one symbol or a dict of feature -> Series/DataFrame of symbols
+    def __init__(self, data):
+        if isinstance(data, pd.DataFrame):
+            data = {name: data[name] for name in data.columns}
+        self.data = {name: obj for name, obj in data.items() if name in AGGREGATIONS}
+        self.index = next(iter(self.data.values())).index
+        self._bounds = {}
+        self._cache = {}
+
+    def bounds(self, timeframe):
+        # Labels and [start, end) base positions of each higher timeframe bar
+        if timeframe not in self._bounds:
+            labels = bar_labels(self.index, timeframe)
+            starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]])
+            ends = np.r_[starts[1:], len(labels)]
+            self._bounds[timeframe] = labels[starts], starts, ends
+        return self._bounds[timeframe]
+
+    def get(self, timeframe):
+        if timeframe not in self._cache:
+            index, starts, ends = self.bounds(timeframe)
+            out = {}
+            for name, obj in self.data.items():
+                values = obj.values
+                agg = AGGREGATIONS[name]
+                if agg == 'first':
+                    values = values[starts]
+                elif agg == 'last':
+                    values = values[ends - 1]
+                elif agg is np.add:
+                    values = np.add.reduceat(np.nan_to_num(values), starts, axis=0)
+                else:
+                    values = agg.reduceat(values, starts, axis=0)  # fmax/fmin skip NaN
+                out[name] = _wrap(values, index, obj)
+            self._cache[timeframe] = out
+        return self._cache[timeframe]
+
+    def align(self, obj, timeframe):
+        # Bring a higher timeframe series back onto the base index without look-ahead:
+        # a bar's value becomes known at the close of its last base bar.
+        _, _, ends = self.bounds(timeframe)
+        values = np.asarray(obj)
+        if values.dtype == np.bool_:
+            # Events fire once, on the base bar that closes the higher timeframe bar
+            out = np.zeros((len(self.index),) + values.shape[1:], dtype=np.bool_)
+            out[ends - 1] = values
+        else:
+            # Levels hold the value of the last completed higher timeframe bar
+            pos = np.searchsorted(ends - 1, np.arange(len(self.index)), side='right') - 1
+            out = np.where(
+                (pos >= 0).reshape((-1,) + (1,) * (values.ndim - 1)),
+                values[np.maximum(pos, 0)],
+                np.nan
+            )
+        return _wrap(out, self.index, obj)
@@ -0,0 +1,278 @@
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import time
+import types
+from contextlib import closing
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import vectorbt as vbt
+
+from portfolio_metrics import metric_names, portfolio_metrics, stat_titles
+
+
+def _digest(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else str(part).encode())
+    return h.hexdigest()
+
+
+# Directory of the project modules whose source is part of the key of the functions they define
+_PROJECT_DIR = Path(__file__).resolve().parent
+
+
+def _project_file(module):
+    path = getattr(module, '__file__', None)
+    if path is None or Path(path).suffix != '.py':
+        return None
+    path = Path(path).resolve()
+    return path if path.parent == _PROJECT_DIR else None
+
+
+def _code_version(func):
+    # Hash of the source files of func's module and, recursively, of the project modules it imports from,
+    # so that editing a helper a kernel calls (e.g. best_weights_nb behind find_weights_nb) changes the key.
+    # Functions of installed packages get none, vbt.__version__ is part of the simulation settings.
+    module = sys.modules.get(getattr(func, '__module__', None))
+    files, stack = set(), [module]
+    while len(stack) > 0:
+        module = stack.pop()
+        path = _project_file(module)
+        if path is None or path in files:
+            continue
+        files.add(path)
+        for value in vars(module).values():
+            if isinstance(value, types.ModuleType):
+                stack.append(value)
+            else:
+                stack.append(sys.modules.get(getattr(getattr(value, 'py_func', value), '__module__', None)))
+    return _digest(*(path.read_bytes() for path in sorted(files)))[:16] if len(files) > 0 else ''
+
+
+def _fingerprint(obj):
+    # JSON-able stand-in of an argument: content hashes for data, source hashes for functions
+    if isinstance(obj, (pd.Series, pd.DataFrame, pd.Index)):
+        labels = obj.columns.tolist() if isinstance(obj, pd.DataFrame) else getattr(obj, 'name', None)
+        return 'data:' + _digest(pd.util.hash_pandas_object(obj, index=True).values.tobytes(), repr(labels))
+    if isinstance(obj, np.ndarray):
+        return 'array:' + _digest(obj.dtype.str, obj.shape, np.ascontiguousarray(obj).tobytes())
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, dict):
+        return {str(k): _fingerprint(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_fingerprint(v) for v in obj]
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    if callable(obj):
+        # Numba dispatchers keep the Python function in py_func, editing its body or any project module it
+        # depends on changes the key
+        func = getattr(obj, 'py_func', obj)
+        try:
+            source = inspect.getsource(func)
+        except (OSError, TypeError):
+            source = ''
+        return f'func:{getattr(func, "__qualname__", repr(func))}:{_digest(source)[:16]}:{_code_version(func)}'
+    return repr(obj)
+
+
+def _simulation_settings():
+    # Global defaults a simulation silently depends on (fees, init_cash, freq, ...)
+    settings = {k: v for k, v in vbt.settings.portfolio.items() if not isinstance(v, dict)}
+    settings['array_wrapper_freq'] = vbt.settings.array_wrapper['freq']
+    settings['year_freq'] = vbt.settings.returns['year_freq']
+    settings['vectorbt'] = vbt.__version__
+    return _fingerprint(settings)
+
+
+def _to_parquet(df, path):
+    # Parquet needs string column labels and homogeneous columns (e.g. tuple column labels in orders)
+    df = df.copy()
+    df.columns = [str(c) for c in df.columns]
+    names = list(df.index.names)
+    if len(set(names)) < len(names):
+        # Index levels of crossed indicators repeat their names, e.g. (ma_window, ma_window, symbol)
+        df.index.names = [f'{n}_{i}' if names.count(n) > 1 else n for i, n in enumerate(names)]
+    for c in df.columns:
+        if df[c].dtype == object and not df[c].map(lambda v: isinstance(v, str) or v is None).all():
+            df[c] = df[c].astype(str)
+    df.to_parquet(path)
+
+
+def _dir_size(path):
+    return sum(f.stat().st_size for f in path.iterdir())
+
+
+class ResultStore:
+    # Content-addressed store of simulated portfolios: a SQLite index plus one directory per run with the pickled
+    # portfolio and Parquet stats, orders and equity, each written the first time it's requested (stats only for
+    # the requested metrics). Runs are keyed by a hash of the data, parameters, settings and
+    # source of the project modules behind the simulation functions, and the least recently used runs are evicted
+    # once the store outgrows max_bytes.
+    def __init__(self, root='.result_store', max_bytes=2 ** 30):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.last_key = None  # key of the latest run(), to read its stored stats, orders or equity
+        self._last_pf = (None, None)  # latest stored or loaded portfolio, so reading its stats doesn't unpickle it
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._execute(
+            'CREATE TABLE IF NOT EXISTS runs '
+            '(key TEXT PRIMARY KEY, kind TEXT, params TEXT, size INTEGER, created REAL, accessed REAL)'
+        )
+
+    def _execute(self, sql, args=()):
+        with closing(sqlite3.connect(self.root / 'index.sqlite')) as con:
+            rows = con.execute(sql, args).fetchall()
+            con.commit()
+        return rows
+
+    def _params(self, args, kwargs, tags):
+        params = dict(tags or {})
+        params.update({f'arg{i}': _fingerprint(arg) for i, arg in enumerate(args)})
+        params.update({k: _fingerprint(v) for k, v in kwargs.items()})
+        return params
+
+    def _key(self, func, params):
+        return _digest(_fingerprint(func), json.dumps(params, sort_keys=True), json.dumps(_simulation_settings()))
+
+    def key(self, func, *args, tags=None, **kwargs):
+        # Key of func(*args, **kwargs), tags are extra metadata (e.g. strategy parameters) to query by
+        return self._key(func, self._params(args, kwargs, tags))
+
+    def path(self, key):
+        return self.root / key
+
+    def __contains__(self, key):
+        return len(self._execute('SELECT 1 FROM runs WHERE key = ?', (key,))) > 0
+
+    def _touch(self, key):
+        self._execute('UPDATE runs SET accessed = ? WHERE key = ?', (time.time(), key))
+
+    def put(self, key, pf, kind='', params=None, outputs=None):
+        # Write to a temporary directory first, so an interrupted write never leaves a half-stored run behind
+        tmp = self.root / f'{key}.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir()
+        (tmp / 'portfolio.pkl').write_bytes(pf.dumps())
+        for name, arr in (outputs or {}).items():
+            np.save(tmp / f'{name}.npy', arr)
+        shutil.rmtree(self.path(key), ignore_errors=True)
+        os.replace(tmp, self.path(key))
+
+        now = time.time()
+        self._execute(
+            'INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?)',
+            (key, kind, json.dumps(params or {}, sort_keys=True), _dir_size(self.path(key)), now, now)
+        )
+        self._last_pf = (key, pf)
+        self.evict(keep=key)
+
+    def _write(self, key, name, df):
+        # Add a file to a stored run and account for its size
+        _to_parquet(df, self.path(key) / name)
+        self._execute('UPDATE runs SET size = ? WHERE key = ?', (_dir_size(self.path(key)), key))
+        self.evict(keep=key)
+
+    def _portfolio(self, key):
+        if self._last_pf[0] == key:
+            return self._last_pf[1]
+        pf = vbt.Portfolio.loads((self.path(key) / 'portfolio.pkl').read_bytes())
+        self._last_pf = (key, pf)
+        return pf
+
+    def get(self, key, outputs=None):
+        # Stored portfolio or None, arrays in outputs are filled in place with what the run wrote into them
+        if key not in self:
+            return None
+        path = self.path(key)
+        self._last_pf = (None, None)
+        pf = self._portfolio(key)
+        for name, arr in (outputs or {}).items():
+            arr[...] = np.load(path / f'{name}.npy')
+        self._touch(key)
+        return pf
+
+    def run(self, func, *args, tags=None, outputs=None, **kwargs):
+        # Same as func(*args, **kwargs), but read back from the store if it was run before.
+        # outputs are arrays the simulation writes into (e.g. Sharpe ratios collected in a callback).
+        params = self._params(args, kwargs, tags)
+        key = self._key(func, params)
+        self.last_key = key
+        pf = self.get(key, outputs)
+        if pf is None:
+            pf = func(*args, **kwargs)
+            self.put(key, pf, getattr(func, '__qualname__', repr(func)), params, outputs)
+        return pf
+
+    def stats(self, keys, metrics='all'):
+        # Stats of one run, or of many runs stacked by key (column labels become columns, as runs may label their
+        # columns differently). metrics selects the stats like in backtest_strategy, e.g. ['total_return', 'max_dd'].
+        # Stats are computed once per run and metric and stored, the portfolio is only loaded for new ones.
+        if not isinstance(keys, str):
+            return pd.concat({key: self.stats(key, metrics).reset_index() for key in keys}, names=['key', None])
+        key = keys
+        self._touch(key)
+        path = self.path(key)
+        done = json.loads((path / 'stats.json').read_text()) if (path / 'stats.json').exists() else []
+        missing = [name for name in metric_names(vbt.Portfolio, metrics) if name not in done]
+        stats = pd.read_parquet(path / 'stats.parquet') if len(done) > 0 else None
+        if len(missing) > 0:
+            pf = self._portfolio(key)
+            new = portfolio_metrics(pf).stats(missing)
+            new = new.to_frame().T if new.ndim == 1 else new
+            if stats is not None:
+                new.index = stats.index
+                new = pd.concat([stats, new], axis=1)
+            self._write(key, 'stats.parquet', new)
+            (path / 'stats.json').write_text(json.dumps(done + missing))
+            stats = pd.read_parquet(path / 'stats.parquet')
+        # Metrics filtered out by vbt (e.g. no trades to compute them from) have no column
+        return stats[[title for title in stat_titles(vbt.Portfolio, metrics) if title in stats.columns]]
+
+    def orders(self, key):
+        self._touch(key)
+        if not (self.path(key) / 'orders.parquet').exists():
+            self._write(key, 'orders.parquet', self._portfolio(key).orders.records_readable)
+        return pd.read_parquet(self.path(key) / 'orders.parquet')
+
+    def equity(self, key):
+        self._touch(key)
+        if not (self.path(key) / 'equity.parquet').exists():
+            equity = portfolio_metrics(self._portfolio(key)).value()
+            self._write(key, 'equity.parquet', equity.to_frame() if isinstance(equity, pd.Series) else equity)
+        return pd.read_parquet(self.path(key) / 'equity.parquet')
+
+    def query(self, kind=None, **params):
+        # Index of stored runs, optionally filtered by kind (e.g. 'Portfolio.from_signals') and parameter values
+        sql = 'SELECT key, kind, params, size, created, accessed FROM runs'
+        rows = self._execute(sql + ' WHERE kind = ?', (kind,)) if kind is not None else self._execute(sql)
+        records = []
+        for key, kind_, params_json, size, created, accessed in rows:
+            run_params = json.loads(params_json)
+            if any(run_params.get(k) != _fingerprint(v) for k, v in params.items()):
+                continue
+            records.append(dict(key=key, kind=kind_, size=size, created=pd.Timestamp(created, unit='s'),
+                                accessed=pd.Timestamp(accessed, unit='s'), **run_params))
+        return pd.DataFrame(records, columns=None if records else ['key', 'kind', 'size', 'created', 'accessed'])
+
+    def evict(self, max_bytes=None, keep=None):
+        # Drop least recently used runs until the store fits into max_bytes. The run keep (the one just written)
+        # is never dropped, even if it alone is larger than max_bytes.
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        rows = self._execute('SELECT key, size FROM runs ORDER BY accessed')
+        total = sum(size for _, size in rows)
+        for key, size in rows:
+            if total <= max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self.path(key), ignore_errors=True)
+            self._execute('DELETE FROM runs WHERE key = ?', (key,))
+            total -= size
@@ -0,0 +1,94 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from numba import njit, prange
+
+from metrics import METRICS, returns_metrics, returns_metrics_nb
+
+# Monte Carlo robustness of a strategy: the historical returns are one path out of many that could have
+# happened. monte_carlo resamples them into n_paths alternative paths and reports the distribution of every
+# metric of metrics.METRICS (annualized_return is the CAGR), with confidence intervals:
+#   result = monte_carlo(pf.returns(), n_paths=10_000, method='block', block_len=20)
+#   result.intervals.loc[['annualized_return', 'sharpe_ratio', 'max_drawdown']]
+# Paths are generated and scored in parallel chunks of chunk_len paths, so memory depends on chunk_len and not
+# on n_paths. Every path has its own random stream, results depend on the seed only, not on chunk_len or the
+# number of threads.
+METHODS = ('block', 'shuffle')
+
+MonteCarloResult = namedtuple('MonteCarloResult', ['metrics', 'intervals'])
+
+
+@njit(cache=True)
+def path_seed_nb(seed, path):
+    # Seed of the random stream of a path, independent of call order and thread scheduling
+    return (seed * 1000003 + path) % 4294967296
+
+
+@njit(parallel=True, cache=True)
+def resample_paths_nb(returns, block_len, shuffle, seed, first_path, out):
+    # Fill every column of out (n_rows, n_paths) with a resampled path of returns (n_rows,):
+    # - block: circular block bootstrap, blocks of block_len consecutive returns starting at random rows,
+    #   keeps the autocorrelation within blocks (volatility clustering, trends)
+    # - shuffle: random permutation, same returns in another order, so only path metrics like drawdown change
+    n_rows = returns.shape[0]
+    for k in prange(out.shape[1]):
+        np.random.seed(path_seed_nb(seed, first_path + k))
+        if shuffle:
+            order = np.random.permutation(n_rows)
+            for i in range(n_rows):
+                out[i, k] = returns[order[i]]
+        else:
+            for i in range(0, n_rows, block_len):
+                start = np.random.randint(0, n_rows)
+                for j in range(min(block_len, n_rows - i)):
+                    out[i + j, k] = returns[(start + j) % n_rows]
+
+
+def trade_returns(pf):
+    # Returns of the closed trades of a single-column portfolio in exit order, to resample the trade list instead
+    # of the bar returns. Annualize with the number of trades per year.
+    trades = pf.trades.closed.records_readable
+    return trades.set_index('Exit Timestamp')['Return'].sort_index()
+
+
+def confidence_intervals(metrics, observed, alpha=0.05):
+    # Distribution of every metric over the paths: mean, median, the central 1 - alpha interval and the
+    # share of paths below the observed value
+    lower, upper = alpha / 2, 1 - alpha / 2
+    quantiles = metrics.quantile([lower, 0.5, upper]).T
+    intervals = pd.DataFrame(dict(
+        observed=observed,
+        mean=metrics.mean(),
+        lower=quantiles[lower],
+        median=quantiles[0.5],
+        upper=quantiles[upper],
+        observed_quantile=(metrics < observed).mean()
+    ))
+    intervals.index.name = 'metric'
+    return intervals
+
+
+def monte_carlo(returns, n_paths=10_000, method='block', block_len=20, ann_factor=None, risk_free=0., alpha=0.05,
+                seed=42, chunk_len=1000):
+    # returns is a Series of bar returns (e.g. pf.returns()) or trade returns (trade_returns), NaNs are dropped.
+    # ann_factor defaults to the one of the returns' frequency, pass the number of trades per year for trades.
+    if method not in METHODS:
+        raise ValueError(f"Unknown method '{method}', expected one of {METHODS}")
+    if ann_factor is None:
+        ann_factor = returns.vbt.returns.ann_factor
+    values = np.asarray(returns, dtype=np.float_)
+    values = np.ascontiguousarray(values[~np.isnan(values)])
+    if len(values) < 2:
+        raise ValueError('At least 2 returns are needed to resample paths')
+
+    metrics = np.empty((n_paths, len(METRICS)))
+    paths = np.empty((len(values), min(chunk_len, n_paths)))
+    for start in range(0, n_paths, chunk_len):
+        size = min(chunk_len, n_paths - start)
+        resample_paths_nb(values, block_len, method == 'shuffle', seed, start, paths[:, :size])
+        metrics[start:start + size] = returns_metrics_nb(paths[:, :size], ann_factor, risk_free)
+
+    metrics = pd.DataFrame(metrics, index=pd.Index(np.arange(n_paths), name='path'), columns=METRICS)
+    observed = returns_metrics(pd.Series(values), ann_factor, risk_free)
+    return MonteCarloResult(metrics, confidence_intervals(metrics, observed, alpha))
@@ -0,0 +1,107 @@
+import atexit
+import os
+import secrets
+from collections import namedtuple
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pandas as pd
+
+# Segments are named <PREFIX><owner pid>_<token>, so ones left behind by a crashed owner can be found
+PREFIX = 'btshm_'
+SHM_DIR = '/dev/shm'
+
+SharedHandle = namedtuple('SharedHandle', ['name', 'shape', 'dtype', 'keys', 'index', 'columns', 'series'])
+
+_attached = {}
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # alive, owned by someone else
+    return True
+
+
+def cleanup_stale():
+    # Unlink segments whose owner process no longer exists (killed before it could clean up)
+    if not os.path.isdir(SHM_DIR):
+        return []
+    removed = []
+    for name in os.listdir(SHM_DIR):
+        if not name.startswith(PREFIX):
+            continue
+        try:
+            pid = int(name[len(PREFIX):].split('_')[0])
+        except ValueError:
+            continue
+        if not _pid_alive(pid):
+            try:
+                os.unlink(os.path.join(SHM_DIR, name))
+                removed.append(name)
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+class SharedFrame:
+    # Publishes a DataFrame/Series, or a dict of aligned ones (e.g. OHLCV features), once in shared memory.
+    # Workers get zero-copy read-only views with attach(shared.handle), the handle only carries the index metadata.
+    # The owner unlinks the segment on close(), at exit, or, after a crash, the next owner does in cleanup_stale().
+    def __init__(self, data):
+        cleanup_stale()
+        frames = data if isinstance(data, dict) else {None: data}
+        first = next(iter(frames.values()))
+        values = np.stack([np.asarray(obj) for obj in frames.values()])
+        self._shm = SharedMemory(
+            create=True,
+            size=max(1, values.nbytes),
+            name=f'{PREFIX}{os.getpid()}_{secrets.token_hex(4)}'
+        )
+        np.ndarray(values.shape, dtype=values.dtype, buffer=self._shm.buf)[:] = values
+        series = isinstance(first, pd.Series)
+        self.handle = SharedHandle(
+            name=self._shm.name,
+            shape=values.shape,
+            dtype=values.dtype.str,
+            keys=None if not isinstance(data, dict) else list(frames.keys()),
+            index=first.index,
+            columns=first.name if series else first.columns,
+            series=series
+        )
+        atexit.register(self.close)
+
+    def close(self):
+        if self._shm is None:
+            return
+        self._shm.close()
+        try:
+            self._shm.unlink()
+        except FileNotFoundError:
+            pass
+        self._shm = None
+        atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def attach(handle):
+    # Zero-copy view of a published SharedFrame, the segment stays mapped for the life of the process
+    if handle.name not in _attached:
+        _attached[handle.name] = SharedMemory(name=handle.name)
+    values = np.ndarray(handle.shape, dtype=handle.dtype, buffer=_attached[handle.name].buf)
+    values.flags.writeable = False
+    if handle.series:
+        frames = [pd.Series(arr, index=handle.index, name=handle.columns, copy=False) for arr in values]
+    else:
+        frames = [pd.DataFrame(arr, index=handle.index, columns=handle.columns, copy=False) for arr in values]
+    if handle.keys is None:
+        return frames[0]
+    return dict(zip(handle.keys, frames))
@@ -0,0 +1,72 @@
+from collections import namedtuple
+
+import numpy as np
+
+Signal = namedtuple('Signal', ['fast_ma', 'slow_ma', 'entry', 'exit'])
+
+
+class RollingMean:
+    # Same arithmetic as vectorbt's rolling_mean_1d_nb (running cumsum minus the cumsum window bars ago),
+    # so values are bit-for-bit identical to vbt.MA.run
+    def __init__(self, window, n_symbols=1):
+        self.window = window
+        self.i = 0
+        self.cumsum = np.zeros(n_symbols)
+        self.nancnt = np.zeros(n_symbols)
+        self.cumsum_buf = np.zeros((window, n_symbols))
+        self.nancnt_buf = np.zeros((window, n_symbols))
+
+    def push(self, x):
+        is_nan = np.isnan(x)
+        self.nancnt = self.nancnt + is_nan
+        self.cumsum = np.where(is_nan, self.cumsum, self.cumsum + x)
+        k = self.i % self.window
+        if self.i < self.window:
+            window_len = self.i + 1 - self.nancnt
+            window_cumsum = self.cumsum
+        else:
+            window_len = self.window - (self.nancnt - self.nancnt_buf[k])
+            window_cumsum = self.cumsum - self.cumsum_buf[k]
+        self.cumsum_buf[k] = self.cumsum
+        self.nancnt_buf[k] = self.nancnt
+        self.i += 1
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(window_len < self.window, np.nan, window_cumsum / window_len)
+
+
+class CrossedAbove:
+    # Same state machine as vectorbt's crossed_above_1d_nb with wait=0
+    def __init__(self, n_symbols=1):
+        self.was_below = np.full(n_symbols, False)
+        self.crossed_ago = np.full(n_symbols, -1)
+
+    def push(self, a, b):
+        is_nan = np.isnan(a) | np.isnan(b)
+        above = ~is_nan & (a > b)
+        below = ~is_nan & (a < b)
+        crossed = above & self.was_below
+        self.crossed_ago = np.where(crossed, self.crossed_ago + 1, np.where(above, self.crossed_ago, -1))
+        self.was_below = (self.was_below | below) & ~is_nan
+        return crossed & (self.crossed_ago == 0)
+
+
+class StreamingCrossover:
+    # Live MA crossover: seed from history, then push one bar at a time in O(1) time and memory per symbol
+    def __init__(self, fast_ma_period, slow_ma_period, n_symbols=1):
+        self.fast_ma = RollingMean(fast_ma_period, n_symbols)
+        self.slow_ma = RollingMean(slow_ma_period, n_symbols)
+        self.entries = CrossedAbove(n_symbols)
+        self.exits = CrossedAbove(n_symbols)
+
+    def push(self, close):
+        # close is one bar for every symbol, returns MA values and entry/exit events for that bar
+        close = np.asarray(close, dtype=np.float_).reshape(-1)
+        fast_ma = self.fast_ma.push(close)
+        slow_ma = self.slow_ma.push(close)
+        return Signal(fast_ma, slow_ma, self.entries.push(fast_ma, slow_ma), self.exits.push(slow_ma, fast_ma))
+
+    def seed(self, history):
+        # history has shape (n_bars,) or (n_bars, n_symbols)
+        for close in np.asarray(history, dtype=np.float_):
+            self.push(close)
+        return self
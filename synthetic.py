@@ -0,0 +1,43 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def correlated_gbm(n_rows, n_assets, mu=0.0005, sigma=0.02, corr=0.5, start='2017-01-01', freq='D',
+                   start_price=100., seed=42):
+    # Close prices of n_assets geometric Brownian motions with pairwise correlation corr, reproducible by seed
+    rng = np.random.default_rng(seed)
+    chol = np.linalg.cholesky(np.full((n_assets, n_assets), corr) + (1 - corr) * np.eye(n_assets))
+    log_returns = (mu - sigma ** 2 / 2) + sigma * rng.standard_normal((n_rows, n_assets)) @ chol.T
+    index = pd.date_range(start, periods=n_rows, freq=freq, tz='UTC', name='Date')
+    columns = pd.Index([f'SYN{i}' for i in range(n_assets)], name='symbol')
+    return pd.DataFrame(start_price * np.exp(np.cumsum(log_returns, axis=0)), index=index, columns=columns)
+
+
+def synthetic_ohlcv(n_rows, n_assets, sigma=0.02, seed=42, **kwargs):
+    # OHLCV bars around correlated GBM closes, in the same per-symbol format as the data providers
+    close = correlated_gbm(n_rows, n_assets, sigma=sigma, seed=seed, **kwargs)
+    rng = np.random.default_rng(seed + 1)
+    open_ = close.shift(1).fillna(close.iloc[0]) * np.exp(sigma / 4 * rng.standard_normal(close.shape))
+    high = np.maximum(open_, close) * np.exp(np.abs(sigma / 2 * rng.standard_normal(close.shape)))
+    low = np.minimum(open_, close) * np.exp(-np.abs(sigma / 2 * rng.standard_normal(close.shape)))
+    volume = pd.DataFrame(rng.lognormal(14, 0.5, close.shape).round(), index=close.index, columns=close.columns)
+    return {
+        symbol: pd.DataFrame({
+            'Open': open_[symbol],
+            'High': high[symbol],
+            'Low': low[symbol],
+            'Close': close[symbol],
+            'Volume': volume[symbol]
+        })
+        for symbol in close.columns
+    }
+
+
+def save_ohlcv(data, data_dir, interval='1d'):
+    # Write bars where FileProvider looks for them, so OHLCVCache can serve them without any network
+    os.makedirs(data_dir, exist_ok=True)
+    for symbol, df in data.items():
+        df.to_parquet(os.path.join(data_dir, f'{symbol}_{interval}.parquet'))
+    return list(data.keys())
@@ -0,0 +1,78 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+import vectorbt as vbt
+
+from backtesting import FEES, sweep_portfolio
+from metrics import returns_metrics
+from shared_data import SharedFrame, attach
+
+_price = None
+
+
+def _init_worker(handle):
+    # Workers map the published price instead of receiving a pickled copy
+    global _price
+    _price = attach(handle)
+
+
+def split_folds(n_rows, train_len, test_len, anchored=False):
+    # (train_start, train_end, test_end) positions; anchored folds always train from the first bar
+    folds = []
+    train_end = train_len
+    while train_end + test_len <= n_rows:
+        folds.append((0 if anchored else train_end - train_len, train_end, train_end + test_len))
+        train_end += test_len
+    return folds
+
+
+def _run_fold(fold, fast_ma_periods, slow_ma_periods, metric):
+    train_start, train_end, test_end = fold
+
+    # In sample: search the best fast/slow pair on the train window
+    train_pf = sweep_portfolio(_price.iloc[train_start:train_end], fast_ma_periods, slow_ma_periods)
+    in_sample = returns_metrics(train_pf.returns(), train_pf.returns_acc.ann_factor)[metric]
+    in_sample = in_sample[np.isfinite(in_sample)]  # pairs that never traded have an infinite Sharpe ratio
+    fast_ma_period, slow_ma_period = in_sample.idxmax() if len(in_sample) > 0 else train_pf.wrapper.columns[0]
+
+    # Out of sample: MAs are warmed up on the history before the test window, but trading starts flat
+    price = _price.iloc[:test_end]
+    fast_ma = vbt.MA.run(price, fast_ma_period)
+    slow_ma = vbt.MA.run(price, slow_ma_period)
+    entries = fast_ma.ma_crossed_above(slow_ma).iloc[train_end:]
+    exits = fast_ma.ma_crossed_below(slow_ma).iloc[train_end:]
+    test_pf = vbt.Portfolio.from_signals(price.iloc[train_end:], entries, exits, fees=FEES)
+
+    record = dict(
+        train_start=_price.index[train_start],
+        test_start=_price.index[train_end],
+        test_end=_price.index[test_end - 1],
+        fast_ma=fast_ma_period,
+        slow_ma=slow_ma_period,
+        in_sample=in_sample.max(),
+        out_of_sample=returns_metrics(test_pf.returns(), test_pf.returns_acc.ann_factor)[metric]
+    )
+    return record, test_pf.returns()
+
+
+def walk_forward(price, fast_ma_periods, slow_ma_periods, train_len, test_len, anchored=False,
+                 metric='sharpe_ratio', n_jobs=None):
+    # Returns one row per fold and the stitched out-of-sample returns
+    folds = split_folds(len(price), train_len, test_len, anchored=anchored)
+    n_jobs = os.cpu_count() if n_jobs is None else n_jobs
+
+    with SharedFrame(price) as shared, \
+            ProcessPoolExecutor(n_jobs, initializer=_init_worker, initargs=(shared.handle,)) as executor:
+        results = list(executor.map(
+            _run_fold,
+            folds,
+            repeat(fast_ma_periods),
+            repeat(slow_ma_periods),
+            repeat(metric)
+        ))
+
+    records, returns = zip(*results)
+    return pd.DataFrame(records), pd.concat(returns)
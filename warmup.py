@@ -0,0 +1,75 @@
+import subprocess
+import sys
+import time
+
+# Warm-up and startup report:
+#   python warmup.py
+# compiles every Numba kernel into the on-disk cache (__pycache__), so later runs load machine code
+# instead of compiling, and reports how long imports and kernels take to get ready.
+HEAVY_MODULES = ('numpy', 'pandas', 'numba', 'vectorbt', 'plotly', 'pyarrow', 'pypfopt', 'matplotlib')
+
+
+def import_times(modules=HEAVY_MODULES):
+    # Import time of each module in a fresh interpreter, None if it isn't installed
+    out = {}
+    for module in modules:
+        code = f'import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)'
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+        out[module] = float(result.stdout) if result.returncode == 0 else None
+    return out
+
+
+def warmup_kernels():
+    # Compile the kernels, or load them from the cache if they were compiled before.
+    # vectorbt's simulate_nb takes our callbacks as arguments and is compiled again in every process.
+    import numpy as np
+    import vectorbt as vbt
+    from synthetic import correlated_gbm
+
+    price = correlated_gbm(64, 3)
+    out = {}
+
+    t0 = time.perf_counter()
+    from metrics import returns_metrics
+    returns_metrics(price.pct_change(), 252.)
+    out['metrics'] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    from weights_search import generate_weights, simulate_metrics, simulate_weights
+    simulate_weights(price, generate_weights(4, price.shape[1]))
+    simulate_metrics(price, generate_weights(4, price.shape[1]), ann_factor=252., chunk_len=3)  # full and last chunk
+    out['weights_search'] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    from portfolio_nb import find_weights_nb, order_func_nb, pre_group_func_nb, pre_segment_func_nb, pre_sim_func_nb
+    vbt.Portfolio.from_order_func(
+        price,
+        order_func_nb,
+        pre_sim_func_nb=pre_sim_func_nb,
+        pre_sim_args=(30,),
+        pre_group_func_nb=pre_group_func_nb,
+        pre_segment_func_nb=pre_segment_func_nb,
+        pre_segment_args=(find_weights_nb, -1, 252., 16, 42, np.full(price.shape[0], np.nan)),
+        call_pre_segment=True,
+        cash_sharing=True,
+        group_by=True
+    )
+    out['portfolio_nb'] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    from martingale import martingale_portfolio
+    martingale_portfolio(price.iloc[:, 0], [2], [4])
+    out['martingale'] = time.perf_counter() - t0
+    return out
+
+
+def startup_report():
+    report = {f'import {module}': seconds for module, seconds in import_times().items()}
+    report.update({f'kernels {name}': seconds for name, seconds in warmup_kernels().items()})
+    for step, seconds in report.items():
+        print(f'{step:<30}' + ('not installed' if seconds is None else f'{seconds:8.2f}s'))
+    return report
+
+
+if __name__ == '__main__':
+    startup_report()
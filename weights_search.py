@@ -0,0 +1,200 @@
+import heapq
+
+import numpy as np
+import pandas as pd
+import vectorbt as vbt
+from numba import njit, prange
+
+from vectorbt.returns.nb import returns_nb
+
+from metrics import METRICS, returns_metrics_nb
+from precision import value_dtype
+
+
+def generate_weights(num_tests, n_assets, seed=42):
+    # Same draws as calling np.random.random_sample(n_assets) num_tests times after seeding
+    np.random.seed(seed)
+    weights = np.random.random_sample((num_tests, n_assets))
+    return weights / weights.sum(axis=1)[:, None]
+
+
+@njit(parallel=True, cache=True)
+def simulate_weights_nb(close, weights, rb_mask, init_cash, fees, value_out):
+    # Target-percent allocation of every weight vector (row) against the same close buffer.
+    # close, weights and value_out can be float32, cash, positions and values are accumulated in float64.
+    n_rows, n_assets = close.shape
+
+    for t in prange(weights.shape[0]):
+        cash = init_cash
+        position = np.zeros(n_assets, dtype=np.float_)
+        for i in range(n_rows):
+            if rb_mask[i]:
+                close_i = close[i].astype(np.float_)
+                value = cash
+                for j in range(n_assets):
+                    value += position[j] * close_i[j]
+                # Execute in order of order value, so sells come before buys, same as call_seq='auto'
+                target = weights[t].astype(np.float_) * value / close_i
+                order_value = (target - position) * close_i
+                for j in np.argsort(order_value):
+                    if target[j] < position[j]:
+                        cash += (position[j] - target[j]) * close_i[j] * (1 - fees)
+                        position[j] = target[j]
+                    elif target[j] > position[j]:
+                        size = min(target[j] - position[j], cash / (close_i[j] * (1 + fees)))
+                        cash -= size * close_i[j] * (1 + fees)
+                        position[j] += size
+            value = cash
+            for j in range(n_assets):
+                value += position[j] * close[i, j]
+            value_out[i, t] = value
+
+
+def _simulation_inputs(price, rb_mask):
+    close = np.ascontiguousarray(price.ffill().values, dtype=value_dtype())
+    if rb_mask is None:
+        rb_mask = np.full(close.shape[0], False)
+        rb_mask[0] = True  # allocate at first timestamp, do nothing afterward
+    return close, np.asarray(rb_mask)
+
+
+def simulate_weights(price, weights, rb_mask=None, init_cash=100., fees=0.):
+    # Value of each candidate portfolio without tiling the price matrix, columns are symbol groups.
+    # Inputs and the value matrix are stored in the dtype of the precision mode (see precision.py).
+    # The value matrix grows with the number of candidates, use simulate_metrics for large searches.
+    close, rb_mask = _simulation_inputs(price, rb_mask)
+    weights = np.ascontiguousarray(weights, dtype=value_dtype())
+    value = np.empty((close.shape[0], weights.shape[0]), dtype=value_dtype())
+    simulate_weights_nb(close, weights, rb_mask, init_cash, fees, value)
+    return pd.DataFrame(value, index=price.index, columns=pd.Index(np.arange(len(weights)), name='symbol_group'))
+
+
+def simulate_metrics(price, weights, rb_mask=None, ann_factor=None, risk_free=0., init_cash=100., fees=0.,
+                     chunk_len=1000):
+    # Metrics (metrics.METRICS) of each candidate portfolio, the same as
+    # returns_metrics(value_returns(simulate_weights(...)).obj, ann_factor), but candidates are simulated in chunks
+    # of chunk_len into one reused value buffer and reduced to metrics right away, so memory depends on chunk_len
+    # and not on the number of candidates.
+    if ann_factor is None:
+        ann_factor = price.vbt.returns.ann_factor
+    close, rb_mask = _simulation_inputs(price, rb_mask)
+    out = np.empty((len(weights), len(METRICS)), dtype=np.float_)
+    value = np.empty((close.shape[0], min(chunk_len, len(weights))), dtype=value_dtype())
+    for start in range(0, len(weights), chunk_len):
+        w = np.ascontiguousarray(weights[start:start + chunk_len], dtype=value_dtype())
+        chunk_value = value[:, :len(w)]
+        simulate_weights_nb(close, w, rb_mask, init_cash, fees, chunk_value)
+        returns = returns_nb(chunk_value, np.full(len(w), init_cash))
+        out[start:start + len(w)] = returns_metrics_nb(returns, ann_factor, risk_free)
+    return pd.DataFrame(out, index=pd.Index(np.arange(len(weights)), name='symbol_group'), columns=METRICS)
+
+
+def value_returns(value, init_cash=100.):
+    return pd.DataFrame.vbt.returns.from_value(value, init_value=init_cash)
+
+
+def screen_weights(price, weights, rb_mask=None, ann_factor=None, chunk_len=10_000):
+    # Closed-form metrics of fee-free allocations: the value path is the asset growth paths times the weights,
+    # compounded between re-balancing days. Candidates are processed in chunks of chunk_len.
+    # Value paths are in the dtype of the precision mode, compounding and moments are accumulated in float64.
+    if ann_factor is None:
+        ann_factor = price.vbt.returns.ann_factor
+    close = price.ffill().values.astype(value_dtype())
+    if rb_mask is None:
+        rb_mask = np.full(close.shape[0], False)
+        rb_mask[0] = True
+    rb_idxs = np.flatnonzero(rb_mask)
+    segment = np.cumsum(rb_mask) - 1  # -1 before the first re-balancing day
+
+    # Growth of each asset since the last re-balancing day, and over each full segment
+    growth = np.ones_like(close)
+    active = segment >= 0
+    growth[active] = close[active] / close[rb_idxs[segment[active]]]
+    segment_growth = close[rb_idxs[1:]] / close[rb_idxs[:-1]]
+
+    out = np.empty((len(weights), 3), dtype=np.float_)
+    for start in range(0, len(weights), chunk_len):
+        w = np.asarray(weights[start:start + chunk_len], dtype=value_dtype()).T
+        value = growth @ w
+        if len(rb_idxs) > 1:
+            # Value carried into each segment
+            carry = np.vstack((np.ones((1, w.shape[1])), np.cumprod(segment_growth @ w, axis=0, dtype=np.float_)))
+            value *= carry[np.maximum(segment, 0)]
+        returns = np.empty_like(value)
+        returns[0] = 0.  # value at the first timestamp equals initial cash
+        returns[1:] = value[1:] / value[:-1] - 1
+        std = returns.std(axis=0, ddof=1, dtype=np.float_)
+        out[start:start + chunk_len, 0] = value[-1].astype(np.float_) ** (ann_factor / value.shape[0]) - 1
+        out[start:start + chunk_len, 1] = std * np.sqrt(ann_factor)
+        out[start:start + chunk_len, 2] = returns.mean(axis=0, dtype=np.float_) / std * np.sqrt(ann_factor)
+
+    return pd.DataFrame(
+        out,
+        index=pd.Index(np.arange(len(weights)), name='symbol_group'),
+        columns=['annualized_return', 'annualized_volatility', 'sharpe_ratio']
+    )
+
+
+def simulate_top_k(price, weights, screened, k=10, metric='sharpe_ratio', rb_mask=None, **kwargs):
+    # Full vectorbt simulation of the K best screened candidates only
+    best = screened[metric].nlargest(k).index.values
+    return simulate_candidates(price, np.asarray(weights)[best], best, rb_mask, **kwargs)
+
+
+def simulate_candidates(price, weights, labels, rb_mask=None, **kwargs):
+    # Full vectorbt simulation of the given weight vectors (rows), one symbol group per label
+    _price = price.astype(value_dtype()).vbt.tile(len(labels), keys=pd.Index(labels, name='symbol_group'))
+    size = np.full_like(_price, np.nan)
+    if rb_mask is None:
+        size[0, :] = np.asarray(weights).ravel()
+    else:
+        size[rb_mask, :] = np.asarray(weights).ravel()
+    return vbt.Portfolio.from_orders(
+        close=_price,
+        size=size,
+        size_type='targetpercent',
+        group_by='symbol_group',
+        cash_sharing=True,
+        call_seq='auto',
+        **kwargs
+    )
+
+
+def batch_seed(seed, batch):
+    # Seed of the batch-th batch of candidates, batches of different seeds don't overlap
+    return (seed * 1000003 + batch) % 4294967296
+
+
+def search_top_k(price, num_tests, k=10, metric='sharpe_ratio', batch_len=10_000, rb_mask=None, seed=42,
+                 ann_factor=None, init_cash=100., fees=0.):
+    # Generate, simulate and score candidates batch by batch, keeping only a running top-K heap, so memory
+    # depends on batch_len and not on num_tests. Every entry keeps its weights and the (seed, row) to redraw them:
+    # generate_weights(batch_len, n_assets, seed)[row]. metric is one of metrics.METRICS, higher is better.
+    if ann_factor is None:
+        ann_factor = price.vbt.returns.ann_factor
+    heap = []
+    for batch, start in enumerate(range(0, num_tests, batch_len)):
+        size = min(batch_len, num_tests - start)
+        weights_seed = batch_seed(seed, batch)
+        weights = generate_weights(size, price.shape[1], seed=weights_seed)
+        metrics = simulate_metrics(price, weights, rb_mask=rb_mask, ann_factor=ann_factor, init_cash=init_cash,
+                                   fees=fees).values
+        score = np.where(np.isnan(metrics[:, METRICS.index(metric)]), -np.inf, metrics[:, METRICS.index(metric)])
+
+        # Only the batch's own top K can enter the heap
+        for row in np.argpartition(-score, min(k, size) - 1)[:k]:
+            entry = (score[row], start + row, weights_seed, row, metrics[row], weights[row])
+            if len(heap) < k:
+                heapq.heappush(heap, entry)
+            elif entry[0] > heap[0][0]:
+                heapq.heapreplace(heap, entry)
+
+    heap.sort(key=lambda entry: -entry[0])
+    top = pd.DataFrame(
+        [entry[4] for entry in heap],
+        index=pd.Index([entry[1] for entry in heap], name='candidate'),
+        columns=METRICS
+    )
+    top['seed'] = [entry[2] for entry in heap]
+    top['row'] = [entry[3] for entry in heap]
+    return top.join(pd.DataFrame([entry[5] for entry in heap], index=top.index, columns=price.columns))